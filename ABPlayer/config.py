@@ -13,6 +13,8 @@ FIELDS = {
     ),
     "dark_theme": "1",
     "language": "ru",
+    # "1" - the library is loaded from the manifest in the books folder
+    "library_manifest": "1",
 }
 
 
@@ -93,6 +95,9 @@ def _validate_config(config: dict) -> dict:
         if config.get("language") not in {"ru", "en"}:
             config["language"] = FIELDS["language"]
             need_update_config = True
+        if config.get("library_manifest") not in {"0", "1"}:
+            config["library_manifest"] = FIELDS["library_manifest"]
+            need_update_config = True
 
         if need_update_config:
             update_config(update_env=False, **config)
@@ -1 +1,11 @@
-from .core import Database
+from .core import (
+    FACETS,
+    IMPORT_BATCH_SIZE,
+    LIBRARY_SORTS,
+    RELEVANCE_SORT,
+    Database,
+)
+from .library_manifest import library_manifest, load_books
+from .read_model import library_model
+from .stop_flags import stop_flags
+from .storage_writer import storage_writer
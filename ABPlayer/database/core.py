@@ -2,105 +2,248 @@
 
 All DB queries described in `Database` class.
 
+Each process (UI and downloader) holds one long-lived connection
+shared by all its threads. `with Database()` blocks are serialized
+by a process-wide lock, so transactions of different threads never mix.
+
+The database works in WAL mode: readers never block the writer and vice versa.
+Writes between processes follow a single-writer discipline:
+a write transaction takes the write lock upfront (`BEGIN IMMEDIATE`)
+and waits for the other process up to `BUSY_TIMEOUT`,
+transactions are kept short,
+and the downloader process updates only the `files` column of the book
+it has downloaded, all other columns are written by the UI process only.
+
 """
 
 from __future__ import annotations
 
+import atexit
 import os
 import sqlite3
+import threading
+import time
 import typing as ty
 
 from loguru import logger
-from models.book import Book
+from models.book import Book, BookCard
+from tools import duration_str_to_sec
 
-from .field_types import adapt_value, convert_value, get_signature
+from .field_types import RowDecoder, adapt_value, get_signature
+from .profiling import explain, query_profiler
+from .read_model import DEBUG, SORT_KEYS, library_model
+from .search_index import SEARCH_FIELDS, book_keywords, normalize, search_index
+from .storage_writer import storage_writer
 
 DATABASE_PATH = os.environ.get("DATABASE_PATH")
+BUSY_TIMEOUT = 10  # Seconds to wait for the write lock held by other process
 BOOK_SIGNATURE = get_signature(Book)
+# Condition of the rows indexed by the unique index of the urls.
+# Books are imported by url. Local books may have no url.
+# Lookups by url repeat the condition, otherwise the index isn't used.
+# The schema is created by migrations (see `migrations`)
+URL_INDEX_CONDITION = "url != ''"
+# Rows added by one statement of the bulk import
+IMPORT_BATCH_SIZE = 500
+# Columns of the full-text search index and their weights in ranking.
+# Changing the columns requires a migration recreating the index
+# (see `migrations.SEARCH_INDEX_COLUMNS_V4`)
+SEARCH_INDEX_COLUMNS = {
+    "name": 10.0,
+    "author": 5.0,
+    "series_name": 3.0,
+    "reader": 1.0,
+}
+# Sorting of search results by relevance (the most relevant first with DESC)
+RELEVANCE_SORT = "-bm25(books_fts, %s)" % ", ".join(
+    map(str, SEARCH_INDEX_COLUMNS.values())
+)
+# Fields required to build the book path in the library
+STORAGE_FIELDS = (
+    "id",
+    "url",
+    "author",
+    "name",
+    "series_name",
+    "number_in_series",
+    "reader",
+    "multi_readers",
+)
+# Columns of the book displayed in the library list
+CARD_FIELDS = (
+    "id",
+    "author",
+    "name",
+    "series_name",
+    "number_in_series",
+    "description",
+    "reader",
+    "duration",
+    "url",
+    "preview",
+    "driver",
+    "status",
+    "favorite",
+    "adding_date",
+    "multi_readers",
+)
+BOOK_COLUMNS = ", ".join(f"books.{field}" for field in BOOK_SIGNATURE)
+CARD_COLUMNS = "%s, books.progress_pct, books.downloaded" % (
+    ", ".join(f"books.{field}" for field in CARD_FIELDS),
+)
+# Columns by which the library is filtered. {<facet>: <column>}
+FACETS = {"authors": "author", "series": "series_name"}
+# Decoders of the rows of full books, cards and storage projection
+BOOK_DECODER = RowDecoder(BOOK_SIGNATURE, BOOK_SIGNATURE)
+CARD_DECODER = RowDecoder(BOOK_SIGNATURE, CARD_FIELDS)
+STORAGE_DECODER = RowDecoder(BOOK_SIGNATURE, STORAGE_FIELDS)
+# Sortings of the library supported by the keyset pagination.
+# {<sort>: (<sort key>, <placeholder of the sort key value>)}
+LIBRARY_SORTS = {
+    # Dates are stored as blobs, the cursor holds them as strings
+    "adding_date": ("books.adding_date", "CAST(? AS BLOB)"),
+    "cast(number_in_series as real)": (
+        "cast(books.number_in_series as real)",
+        "?",
+    ),
+    "duration_sec": ("books.duration_sec", "?"),
+}
 
 
 class Database:
     database_path = DATABASE_PATH
 
+    _conn: sqlite3.Connection | None = None  # Connection of the process
+    _lock = threading.RLock()
+    _depth: int = 0  # Nesting level of `with Database()` blocks
+    fts_available: bool = False  # True - FTS5 is supported by SQLite
+    # {<facet>: (<library version>, <facet values>)}
+    _facets_cache: dict[str, tuple[tuple, list[tuple]]] = {}
+
     def __init__(self, autocommit: bool = False):
         self.autocommit = autocommit
         self.conn: sqlite3.Connection | None = None
         self._cursor: sqlite3.Cursor | None = None
 
+    @classmethod
+    def _get_connection(cls) -> sqlite3.Connection:
+        """
+        Opens the connection of the process on first call.
+        """
+        if cls._conn is None:
+            logger.trace("opening database connection")
+            cls._conn = sqlite3.connect(
+                cls.database_path,
+                timeout=BUSY_TIMEOUT,
+                # `BEGIN IMMEDIATE` before INSERT/UPDATE/DELETE
+                isolation_level="IMMEDIATE",
+                check_same_thread=False,
+                cached_statements=256,
+            )
+            cls._conn.execute("PRAGMA journal_mode=WAL")
+            cls._conn.execute("PRAGMA synchronous=NORMAL")
+            cls._conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT * 1000}")
+            atexit.register(cls.close)
+            # Called before closing, as writes can query the database
+            atexit.register(storage_writer.flush)
+        return cls._conn
+
+    @classmethod
+    def close(cls) -> None:
+        """
+        Closes the connection of the process.
+        """
+        with cls._lock:
+            if cls._conn is None:
+                return
+            logger.trace("closing database connection")
+            if cls._conn.in_transaction:
+                cls._conn.rollback()
+            cls._conn.execute("PRAGMA optimize")
+            cls._conn.close()
+            cls._conn = None
+
     def _connect(self) -> None:
-        self.conn = sqlite3.connect(
-            self.database_path, detect_types=sqlite3.PARSE_DECLTYPES
-        )
+        self.conn = self._get_connection()
         self._cursor = self.conn.cursor()
 
     def __enter__(self) -> ty.Self:
-        self._connect()
+        self._lock.acquire()
+        Database._depth += 1
+        try:
+            self._connect()
+        except Exception:
+            Database._depth -= 1
+            self._lock.release()
+            raise
         return self
 
     def _fetchone(self, query: str, *args) -> tuple | None:
-        self._execute(query, *args)
-        return self._cursor.fetchone()
+        start_time = time.perf_counter()
+        self._execute(query, *args, record=False)
+        row = self._cursor.fetchone()
+        if query_profiler.enabled:
+            query_profiler.record(
+                self.conn, query, args, start_time, int(row is not None)
+            )
+        return row
 
     def _fetchall(self, query: str, *args) -> list[tuple]:
-        self._execute(query, *args)
-        return self._cursor.fetchall()
+        start_time = time.perf_counter()
+        self._execute(query, *args, record=False)
+        rows = self._cursor.fetchall()
+        if query_profiler.enabled:
+            query_profiler.record(
+                self.conn, query, args, start_time, len(rows)
+            )
+        return rows
+
+    def explain(self, query: str, *args) -> str:
+        """
+        :returns: Query plan of the statement as a tree.
+        """
+        return explain(self.conn, query, args)
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        if self.autocommit:
-            self.conn.commit()
-        self._cursor.close()
-        self.conn.close()
+        try:
+            if self.autocommit:
+                self.conn.commit()
+            elif Database._depth == 1 and self.conn.in_transaction:
+                # Uncommitted changes are discarded
+                # as it was when the connection was closed
+                self.conn.rollback()
+                library_model.invalidate()
+                search_index.invalidate()
+            self._cursor.close()
+        finally:
+            Database._depth -= 1
+            self._lock.release()
 
     @logger.catch
-    def _execute(self, query: str, *args) -> None:
+    def _execute(self, query: str, *args, record: bool = True) -> None:
+        """
+        :param record: False - the statement is recorded by the caller
+            (after fetching).
+        """
+        start_time = time.perf_counter()
         self._cursor.execute(query, args)
+        if record and query_profiler.enabled:
+            query_profiler.record(
+                self.conn, query, args, start_time, self._cursor.rowcount
+            )
+
+    @logger.catch
+    def _executemany(self, query: str, args: list[tuple]) -> None:
+        start_time = time.perf_counter()
+        self._cursor.executemany(query, args)
+        if query_profiler.enabled and args:
+            query_profiler.record(
+                self.conn, query, args[0], start_time, self._cursor.rowcount
+            )
 
     def commit(self) -> None:
         self.conn.commit()
 
-    def create_library(self) -> None:
-        fields = [
-            f"{field.field_name} {field.sql_type}"
-            for field in BOOK_SIGNATURE.values()
-            if field.field_name != "id"
-        ]
-        self._execute(
-            "CREATE TABLE IF NOT EXISTS books "
-            "(id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, %s)"
-            % (", ".join(fields))
-        )
-
-    def validate_columns(self) -> None:
-        exists_fields = [
-            field[1] for field in self._fetchall("PRAGMA table_info(books)")
-        ]
-        columns_to_delete = []
-        columns_to_add = []
-        for field in BOOK_SIGNATURE.values():
-            if field.field_name not in exists_fields:
-                columns_to_add.append(field.field_name)
-        for field in exists_fields:
-            if field not in BOOK_SIGNATURE:
-                columns_to_delete.append(field.field_name)
-        for field in columns_to_delete:
-            self._execute(f"ALTER TABLE books DROP COLUMN {field}")
-        for field in columns_to_add:
-            self._execute(
-                f"ALTER TABLE books ADD COLUMN {field} {BOOK_SIGNATURE[field].sql_type}"
-            )
-        if columns_to_add:
-            book = Book()
-            self._execute(
-                "UPDATE books SET "
-                + ", ".join(f"{field}=?" for field in columns_to_add),
-                *(getattr(book, field) for field in columns_to_add),
-            )
-        if columns_to_delete or columns_to_add:
-            logger.debug(
-                f"Columns {columns_to_delete} deleted; Columns {columns_to_add} added"
-            )
-            self.commit()
-
     def get_libray(
         self,
         limit: int | None = None,
@@ -112,26 +255,21 @@ class Database:
         favorite: bool | None = None,
         status: str | None = None,
         bids: list[int] | None = None,
-    ) -> list[Book]:
-        q = "SELECT * FROM books"
-        args = []
-
-        conditions = []
-        if author is not None:
-            conditions.append("author=?")
-            args.append(author)
-        if series is not None:
-            conditions.append("series_name=?")
-            args.append(series)
-        if favorite is not None:
-            conditions.append("favorite=?")
-            args.append(favorite)
-        if status is not None:
-            conditions.append("status=?")
-            args.append(status)
-        if bids is not None:
-            conditions.append(f"id IN ({','.join(['?'] * len(bids))})")
-            args.extend(bids)
+        search_query: str | None = None,
+        progress: tuple[int, int] | None = None,
+        cards: bool = False,
+    ) -> list[Book] | list[BookCard]:
+        """
+        :param search_query: Search by the full-text search index.
+            Use `RELEVANCE_SORT` to sort the result by relevance.
+        :param progress: Range of the listening progress (in percentage).
+        :param cards: True - only the data displayed in the library list
+            is loaded (see `BookCard`).
+        """
+        join, conditions, args = _library_filters(
+            author, series, favorite, status, bids, search_query, progress
+        )
+        q = f"SELECT {CARD_COLUMNS if cards else BOOK_COLUMNS} FROM books{join}"
         if conditions:
             q += " WHERE " + " AND ".join(conditions)
 
@@ -146,60 +284,339 @@ class Database:
             q += " OFFSET ?"
             args.append(offset)
 
-        return [_convert_book(data) for data in self._fetchall(q, *args)]
+        convert = _convert_card if cards else _convert_book
+        return [convert(data) for data in self._fetchall(q, *args)]
+
+    def get_library_page(
+        self,
+        limit: int,
+        cursor: ty.Any = None,
+        sort: str = "adding_date",
+        reverse: bool = True,
+        author: str | None = None,
+        series: str | None = None,
+        favorite: bool | None = None,
+        status: str | None = None,
+        bids: list[int] | None = None,
+        search_query: str | None = None,
+        progress: tuple[int, int] | None = None,
+    ) -> tuple[list[BookCard], ty.Any]:
+        """
+        Page of the library cards.
+        Sortings from `LIBRARY_SORTS` are paginated by the keyset
+        (sort key, id), so any page costs the same as the first one.
+        Other sortings (relevance) are paginated by the offset.
+        :param cursor: Cursor returned with the previous page.
+            None - the first page.
+        :returns: Cards and the cursor of the next page
+            (None if it is the last page).
+        """
+        if search_query is None and sort in SORT_KEYS:
+            library_model.sync(self)
+            page = library_model.page(
+                limit,
+                cursor,
+                sort,
+                reverse,
+                author,
+                series,
+                favorite,
+                status,
+                bids,
+                progress,
+            )
+            if DEBUG:
+                self._check_library_page(
+                    page,
+                    self._query_library_page(
+                        limit,
+                        cursor,
+                        sort,
+                        reverse,
+                        author,
+                        series,
+                        favorite,
+                        status,
+                        bids,
+                        search_query,
+                        progress,
+                    ),
+                )
+            return page
+        return self._query_library_page(
+            limit,
+            cursor,
+            sort,
+            reverse,
+            author,
+            series,
+            favorite,
+            status,
+            bids,
+            search_query,
+            progress,
+        )
+
+    def _query_library_page(
+        self,
+        limit: int,
+        cursor: ty.Any,
+        sort: str,
+        reverse: bool,
+        author: str | None,
+        series: str | None,
+        favorite: bool | None,
+        status: str | None,
+        bids: list[int] | None,
+        search_query: str | None,
+        progress: tuple[int, int] | None,
+    ) -> tuple[list[BookCard], ty.Any]:
+        if sort not in LIBRARY_SORTS:
+            offset = cursor or 0
+            cards = self.get_libray(
+                limit,
+                offset,
+                sort,
+                reverse,
+                author,
+                series,
+                favorite,
+                status,
+                bids,
+                search_query,
+                progress,
+                cards=True,
+            )
+            return cards, offset + len(cards) if len(cards) == limit else None
+
+        key, key_param = LIBRARY_SORTS[sort]
+        join, conditions, args = _library_filters(
+            author, series, favorite, status, bids, search_query, progress
+        )
+        if cursor is not None:
+            conditions.append(
+                f"({key}, books.id) {'<' if reverse else '>'} ({key_param}, ?)"
+            )
+            args.extend(cursor)
+        q = f"SELECT {CARD_COLUMNS}, {key} FROM books{join}"
+        if conditions:
+            q += " WHERE " + " AND ".join(conditions)
+        order = "DESC" if reverse else "ASC"
+        q += f" ORDER BY {key} {order}, books.id {order} LIMIT ?"
+        args.append(limit)
+
+        rows = self._fetchall(q, *args)
+        if len(rows) < limit:
+            return [_convert_card(data[:-1]) for data in rows], None
+        last_key = rows[-1][-1]
+        if isinstance(last_key, bytes):
+            last_key = last_key.decode()
+        return [_convert_card(data[:-1]) for data in rows], [
+            last_key,
+            rows[-1][0],
+        ]
+
+    @staticmethod
+    def _check_library_page(
+        page: tuple[list[BookCard], ty.Any],
+        queried_page: tuple[list[BookCard], ty.Any],
+    ) -> None:
+        """
+        Compares the page of the read model with the queried one.
+        """
+        if page != queried_page:
+            logger.error(
+                "library model is inconsistent with the database. "
+                f"model: {[card.id for card in page[0]]}, {page[1]}; "
+                f"database: {[card.id for card in queried_page[0]]}, "
+                f"{queried_page[1]}"
+            )
+
+    def count_library(
+        self,
+        author: str | None = None,
+        series: str | None = None,
+        favorite: bool | None = None,
+        status: str | None = None,
+        bids: list[int] | None = None,
+        search_query: str | None = None,
+        progress: tuple[int, int] | None = None,
+    ) -> int:
+        """
+        :returns: Number of the books matching the filters.
+        """
+        if search_query is None:
+            library_model.sync(self)
+            return library_model.count(
+                author, series, favorite, status, bids, progress
+            )
+        join, conditions, args = _library_filters(
+            author, series, favorite, status, bids, search_query, progress
+        )
+        q = f"SELECT count(*) FROM books{join}"
+        if conditions:
+            q += " WHERE " + " AND ".join(conditions)
+        return self._fetchone(q, *args)[0]
+
+    def get_cards(self, *bids: int) -> list[tuple[BookCard, int | None]]:
+        """
+        :param bids: No bids - all books.
+        :returns: Cards of the books and their duration in seconds.
+        """
+        q = f"SELECT {CARD_COLUMNS}, books.duration_sec FROM books"
+        if bids:
+            q += f" WHERE books.id IN ({','.join('?' * len(bids))})"
+        return [
+            (_convert_card(data[:-1]), data[-1])
+            for data in self._fetchall(q, *bids)
+        ]
+
+    def get_data_version(self) -> int:
+        """
+        :returns: Number that changes when another process commits changes.
+        """
+        return self._fetchone("PRAGMA data_version")[0]
 
     def get_book_by_bid(self, bid: int) -> Book | None:
-        if books := self._fetchall("SELECT * FROM books WHERE id=?", bid):
+        if books := self._fetchall(
+            f"SELECT {BOOK_COLUMNS} FROM books WHERE id=?", bid
+        ):
             return _convert_book(books[0])
 
     def get_books_by_bid(self, *bids: int) -> list[Book] | None:
         if books := self._fetchall(
-            f"SELECT {', '.join(BOOK_SIGNATURE.keys())} FROM books "
+            f"SELECT {BOOK_COLUMNS} FROM books "
             f"WHERE id IN [{','.join(['?'] * len(bids))}]",
             *bids,
         ):
             return [_convert_book(book) for book in books]
 
-    def get_book_by_url(self, url: str) -> Book | None:
-        if books := self._fetchall("SELECT * FROM books WHERE url=?", url):
-            return _convert_book(books[0])
+    def get_books_names(self, *bids: int) -> dict[int, str]:
+        """
+        :returns: {<bid>: <book name>} of the existing books.
+        """
+        if not bids:
+            return {}
+        return dict(
+            self._fetchall(
+                f"SELECT id, name FROM books "
+                f"WHERE id IN ({','.join('?' * len(bids))})",
+                *bids,
+            )
+        )
 
-    def get_books_keywords(self) -> dict[int, list[ty.Any]]:
-        result = {}
-        for book in self._fetchall(
-            "SELECT id, name, author, series_name FROM books"
+    def get_book_by_url(self, url: str) -> Book | None:
+        if books := self._fetchall(
+            f"SELECT {BOOK_COLUMNS} FROM books "
+            f"WHERE url=? AND {URL_INDEX_CONDITION}",
+            url,
         ):
-            result[book[0]] = []
-            for field in book[1:]:
-                if field:
-                    result[book[0]].extend(field.lower().split())
-        return result
+            return _convert_book(books[0])
 
-    def get_all_authors(self) -> list[str]:
+    def get_books_storage_data(self) -> list[tuple[Book, bool]]:
+        """
+        Lightweight projection used to reconcile the library with the storage.
+        Items, description and files are not loaded.
+        :returns: List of (<book with path fields only>, <has files>).
+        """
         return [
-            obj[0] for obj in set(self._fetchall("SELECT author FROM books"))
+            (_convert_storage_book(data[:-1]), bool(data[-1]))
+            for data in self._fetchall(
+                f"SELECT {', '.join(STORAGE_FIELDS)}, length(files) > 2 "
+                "FROM books"
+            )
         ]
 
-    def get_all_series(self) -> list[str]:
-        return [
-            obj[0]
-            for obj in set(self._fetchall("SELECT series_name FROM books"))
-        ]
+    def get_books_keywords(self) -> dict[int, list[str]]:
+        """
+        :returns: {<bid>: [<normalized word>, ...]}
+        """
+        return {
+            book[0]: normalize(" ".join(filter(None, book[1:])))
+            for book in self._fetchall(
+                f"SELECT id, {', '.join(SEARCH_FIELDS)} FROM books"
+            )
+        }
 
-    def get_series_durations(self, series_name: str) -> list[str]:
-        return [
-            obj[0]
-            for obj in self._fetchall(
-                "SELECT duration FROM books WHERE series_name=?", series_name
+    def has_search_matches(self, query: str) -> bool:
+        """
+        :returns: True - full-text search index has books matching the query.
+        """
+        return bool(
+            self._fetchone(
+                "SELECT rowid FROM books_fts WHERE books_fts MATCH ? LIMIT 1",
+                _make_search_query(query),
             )
-        ]
+        )
+
+    def fuzzy_search(self, query: str, limit: int | None = None) -> list[int]:
+        """
+        Typo-tolerant search by the in-memory trigram index.
+        The index is built on the first call.
+        :returns: Bids of the matched books, the most relevant first.
+        """
+        if not search_index.built:
+            search_index.build(self.get_books_keywords())
+        return search_index.search(query, limit)
+
+    def get_all_authors(self) -> list[str]:
+        return [obj[0] for obj in self.get_facets("authors")]
 
-    def check_is_books_exists(self, urls: list[str]) -> list[str]:
+    def get_all_series(self) -> list[str]:
+        return [obj[0] for obj in self.get_facets("series")]
+
+    def get_facets(self, facet: str) -> list[tuple[str, int, int, int]]:
+        """
+        Distinct values of the column from `FACETS`, sorted by the value.
+        The result is cached until the library is changed by any process.
+        :returns: List of
+            (<value>, <books count>, <downloaded books count>,
+            <total duration in seconds>).
+        """
+        version = (
+            self.conn.total_changes,  # Changes made by this process
+            self.get_data_version(),  # By other processes
+            # Uncommitted changes may be rolled back
+            self.conn.in_transaction,
+        )
+        if (cached := self._facets_cache.get(facet)) and cached[0] == version:
+            return cached[1]
+        column = FACETS[facet]
+        facets = self._fetchall(
+            f"SELECT {column}, count(*), coalesce(sum(downloaded), 0), "
+            f"coalesce(sum(duration_sec), 0) FROM books "
+            f"WHERE {column} != '' GROUP BY {column} ORDER BY {column}"
+        )
+        Database._facets_cache[facet] = (version, facets)
+        return facets
+
+    def get_series_duration(self, series_name: str) -> int:
+        """
+        :returns: Total duration of the series books (in seconds).
+        """
+        return int(
+            self._fetchone(
+                "SELECT total(duration_sec) FROM books WHERE series_name=?",
+                series_name,
+            )[0]
+        )
+
+    def check_is_books_exists(
+        self, urls: list[str], downloaded: bool | None = None
+    ) -> list[str]:
+        """
+        :param downloaded: True/False - only downloaded/not downloaded books.
+        :returns: Urls of the books that are in the library.
+        """
+        condition = (
+            f"url IN ({','.join('?' * len(urls))}) AND {URL_INDEX_CONDITION}"
+        )
+        if downloaded is not None:
+            condition += f" AND downloaded = {int(downloaded)}"
         return [
             url[0]
             for url in self._fetchall(
-                f"SELECT url FROM books WHERE url IN ({','.join('?' * len(urls))})",
-                *urls,
+                f"SELECT url FROM books WHERE {condition}", *urls
             )
         ]
 
@@ -215,6 +632,7 @@ class Database:
                 self._execute(
                     f"UPDATE books SET multi_readers=? WHERE id=?", True, bid
                 )
+                library_model.mark_dirty(bid)
                 return self.get_book_by_bid(bid)
 
     def add_book(self, book: Book) -> None:
@@ -223,6 +641,7 @@ class Database:
             for field_name in BOOK_SIGNATURE.keys()
             if field_name != "id"
         }
+        fields["duration_sec"] = _parse_duration(book.duration)
         self._execute(
             "INSERT INTO books (%s) VALUES (%s)"
             % (
@@ -231,6 +650,56 @@ class Database:
             ),
             *fields.values(),
         )
+        search_index.add(self._cursor.lastrowid, book_keywords(book))
+        library_model.mark_dirty(self._cursor.lastrowid)
+
+    def import_books(
+        self, books: ty.Sequence[Book], update_files: bool = False
+    ) -> int:
+        """
+        Adds the books to the library by one statement.
+        Books that are already in the library (by url) are skipped.
+        `.abp` files aren't written.
+        :param update_files: True - files of the existing books are replaced
+            with the files of the imported ones.
+        :returns: Number of the added books.
+        """
+        if not books:
+            return 0
+        fields = [
+            field_name for field_name in BOOK_SIGNATURE if field_name != "id"
+        ]
+        # New rows get ids greater than any existing (AUTOINCREMENT)
+        last_bid = self._fetchone("SELECT coalesce(max(id), 0) FROM books")[0]
+        self._executemany(
+            "INSERT INTO books (%s, duration_sec) VALUES (%s) "
+            "ON CONFLICT(url) WHERE %s DO %s"
+            % (
+                ", ".join(fields),
+                ", ".join(["?"] * (len(fields) + 1)),
+                URL_INDEX_CONDITION,
+                (
+                    "UPDATE SET files=excluded.files"
+                    if update_files
+                    else "NOTHING"
+                ),
+            ),
+            [
+                (
+                    *(adapt_value(getattr(book, field)) for field in fields),
+                    _parse_duration(book.duration),
+                )
+                for book in books
+            ],
+        )
+        added = self._fetchone(
+            "SELECT count(*) FROM books WHERE id > ?", last_bid
+        )[0]
+        if added:
+            # Rebuilt on the next search
+            search_index.invalidate()
+        library_model.invalidate()
+        return added
 
     def save(self, book: Book) -> None:
         if book.id is None:
@@ -243,24 +712,65 @@ class Database:
         }
         self.update(book.id, **fields)
         if book.files:
-            book.save_to_storage()
+            storage_writer.save(book)
 
     def update(self, bid: int, **fields) -> None:
         fields = {
             field_name: adapt_value(obj) for field_name, obj in fields.items()
         }
+        if "duration" in fields:
+            fields["duration_sec"] = _parse_duration(fields["duration"])
         self._execute(
             "UPDATE books SET %s WHERE id=?"
             % (", ".join(map(lambda x: f"{x}=?", fields.keys()))),
             *fields.values(),
             bid,
         )
+        library_model.mark_dirty(bid)
+        if search_index.built and not fields.keys().isdisjoint(SEARCH_FIELDS):
+            if row := self._fetchone(
+                f"SELECT {', '.join(SEARCH_FIELDS)} FROM books WHERE id=?", bid
+            ):
+                search_index.add(bid, normalize(" ".join(filter(None, row))))
+
+    def patch(self, bid: int, **fields) -> bool:
+        """
+        Writes only the given columns.
+        If the book is downloaded, the same fields are patched in its `.abp`.
+        Fields that define the book path can't be patched.
+        :returns: False - the book is not found.
+        """
+        if not fields.keys().isdisjoint(STORAGE_FIELDS):
+            raise ValueError("fields of the book path can't be patched")
+        self.update(bid, **fields)
+        if self._cursor.rowcount < 1:
+            return False
+        if data := self._fetchone(
+            f"SELECT {', '.join(STORAGE_FIELDS)} FROM books "
+            "WHERE id=? AND length(files) > 2",
+            bid,
+        ):
+            storage_writer.patch(_convert_storage_book(data), **fields)
+        return True
+
+    def get_fields(self, bid: int, *fields: str) -> tuple | None:
+        """
+        :returns: Values of the given columns of the book.
+        """
+        if row := self._fetchone(
+            f"SELECT {', '.join(fields)} FROM books WHERE id=?", bid
+        ):
+            return tuple(RowDecoder(BOOK_SIGNATURE, fields)(row))
 
     def remove_book(self, bid: int) -> None:
         self._execute("DELETE FROM books WHERE id=?", bid)
+        search_index.remove(bid)
+        library_model.mark_dirty(bid)
 
     def clear(self) -> None:
         self._execute("DELETE FROM books")
+        search_index.invalidate()
+        library_model.invalidate()
 
     def clear_files(self, *bids: int) -> None:
         if bids:
@@ -275,8 +785,12 @@ class Database:
                 *bids,
                 "",
             )
+            if self._cursor.rowcount:
+                search_index.invalidate()
+            library_model.mark_dirty(*bids)
         else:
             self._execute("UPDATE books SET files='{}'")
+            library_model.invalidate()
 
     def is_library_empty(self) -> bool:
         return not bool(self._fetchone("SELECT id FROM books"))
@@ -284,17 +798,92 @@ class Database:
     @classmethod
     def init(cls) -> None:
         logger.trace("database initialization")
+        from .migrations import migrate
+
         with cls() as db:
-            db.create_library()
-            db.validate_columns()
+            migrate(db.conn)
+            Database.fts_available = bool(
+                db._fetchone(
+                    "SELECT name FROM sqlite_master "
+                    "WHERE type='table' AND name='books_fts'"
+                )
+            )
 
 
 def _convert_book(data: tuple[ty.Any]) -> Book:
     if len(data) != len(BOOK_SIGNATURE):
         raise ValueError()
-
-    kwargs = {}
-    for field, value in zip(BOOK_SIGNATURE.values(), data):
-        kwargs[field.field_name] = convert_value(field, value)
-
-    return Book(**kwargs)
+    return Book(*BOOK_DECODER(data))
+
+
+def _library_filters(
+    author: str | None,
+    series: str | None,
+    favorite: bool | None,
+    status: str | None,
+    bids: list[int] | None,
+    search_query: str | None,
+    progress: tuple[int, int] | None = None,
+) -> tuple[str, list[str], list[ty.Any]]:
+    """
+    :returns: Join clause, conditions and their arguments
+        of the library query.
+    """
+    join = ""
+    conditions = []
+    args = []
+    if search_query is not None:
+        join = " JOIN books_fts ON books_fts.rowid = books.id"
+        conditions.append("books_fts MATCH ?")
+        args.append(_make_search_query(search_query))
+    if author is not None:
+        conditions.append("books.author=?")
+        args.append(author)
+    if series is not None:
+        conditions.append("books.series_name=?")
+        args.append(series)
+    if favorite is not None:
+        conditions.append("books.favorite=?")
+        args.append(favorite)
+    if status is not None:
+        conditions.append("books.status=?")
+        args.append(status)
+    if bids is not None:
+        conditions.append(f"books.id IN ({','.join(['?'] * len(bids))})")
+        args.extend(bids)
+    if progress is not None:
+        conditions.append("books.progress_pct BETWEEN ? AND ?")
+        args.extend(progress)
+    return join, conditions, args
+
+
+def _convert_card(data: tuple[ty.Any]) -> BookCard:
+    return BookCard(
+        *CARD_DECODER(data), progress=data[-2], downloaded=bool(data[-1])
+    )
+
+
+def _parse_duration(duration: str) -> int | None:
+    """
+    :returns: Duration in seconds or None if the format is unknown.
+    """
+    try:
+        return duration_str_to_sec(duration)
+    except (ValueError, TypeError):
+        return None
+
+
+def _make_search_query(query: str) -> str:
+    """
+    Converts the user query to the FTS5 query.
+    Each word is searched as a prefix, books matching more words rank higher.
+    """
+    words = query.lower().replace("ё", "е").split()
+    return (
+        " OR ".join('"%s"*' % word.replace('"', '""') for word in words)
+        or '""'
+    )
+
+
+def _convert_storage_book(data: tuple[ty.Any]) -> Book:
+    return Book(**dict(zip(STORAGE_FIELDS, STORAGE_DECODER(data))))
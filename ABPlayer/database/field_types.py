@@ -4,14 +4,14 @@ import dataclasses
 import sqlite3
 import types as tys
 import typing as ty
-from contextlib import suppress
 from datetime import datetime
 from enum import Enum
 from inspect import isclass
 
 import orjson
 from loguru import logger
-from models.book import DATETIME_FORMAT
+from models.book import DATETIME_FORMAT, ColumnarBookItems
+from models.codec import decode_datetime, make_value_decoder
 
 SQL_TYPES = {
     "str": "TEXT",
@@ -25,26 +25,22 @@ def adapt_json(obj: ty.Any) -> bytes:
     return orjson.dumps(obj)
 
 
-@logger.catch
-def convert_json(obj: bytes) -> ty.Any:
-    return orjson.loads(obj)
-
-
 sqlite3.register_adapter(dict, adapt_json)
 sqlite3.register_adapter(list, adapt_json)
-sqlite3.register_converter("json", convert_json)
 
 
 def adapt_datetime(obj: datetime) -> bytes:
     return obj.strftime(DATETIME_FORMAT).encode()
 
 
-def convert_datetime(obj: bytes) -> datetime:
-    return datetime.strptime(obj.decode("utf-8"), DATETIME_FORMAT)
+sqlite3.register_adapter(datetime, adapt_datetime)
 
 
-sqlite3.register_adapter(datetime, adapt_datetime)
-sqlite3.register_converter("datetime", convert_datetime)
+def adapt_columnar_items(obj: ColumnarBookItems) -> bytes:
+    return orjson.dumps(obj.to_dump())
+
+
+sqlite3.register_adapter(ColumnarBookItems, adapt_columnar_items)
 
 
 @dataclasses.dataclass
@@ -88,16 +84,70 @@ def get_signature(model) -> dict[str, Field]:
     return signature
 
 
-def convert_value(field: Field, obj: ty.Any) -> ty.Any:
-    if type(obj) == field.python_type:
-        return obj
+def make_decoder(field: Field) -> ty.Callable[[ty.Any], ty.Any]:
+    """
+    Creates a function converting the column value to the field type.
+    The field type is inspected once, not on each value.
+    :returns: Decoder of the column.
+    """
+    python_type = field.python_type
+    if field.sql_type == "datetime":
+        decoder = decode_datetime
+    elif isclass(python_type) and issubclass(python_type, Enum):
+        decoder = python_type
+    elif field.sql_type != "json" or isinstance(python_type, UnionType):
+        # Stored as is
+        return _identity
+    elif python_type is bool:
+        decoder = _decode_bool
+    else:
+        value_decoder = make_value_decoder(python_type)
+        decoder = lambda obj: value_decoder(orjson.loads(obj))
+    return _nullable(decoder)
+
+
+class RowDecoder:
+    """
+    Converts rows of the given columns to the model field values.
+    Decoders of the columns are created once.
+    """
+
+    def __init__(self, signature: dict[str, Field], columns: ty.Iterable[str]):
+        self.columns = tuple(columns)
+        self._decoders = tuple(
+            make_decoder(signature[column]) for column in self.columns
+        )
+
+    def __call__(self, row: tuple[ty.Any, ...]) -> list[ty.Any]:
+        """
+        :returns: Values in the order of the columns.
+        """
+        return [decoder(obj) for decoder, obj in zip(self._decoders, row)]
+
+
+def _identity(obj: ty.Any) -> ty.Any:
+    return obj
+
+
+def _nullable(
+    decoder: ty.Callable[[ty.Any], ty.Any],
+) -> ty.Callable[[ty.Any], ty.Any]:
+    def wrapper(obj: ty.Any) -> ty.Any:
+        if obj is None:
+            return None
+        try:
+            return decoder(obj)
+        except (ValueError, TypeError) as err:
+            logger.error(f"failed to decode {obj!r}. {err}")
+
+    return wrapper
+
 
-    with suppress(ValueError, TypeError):
-        if dataclasses.is_dataclass(field.python_type):
-            if type(obj) is dict:
-                return field.python_type(**obj)
-            return field.python_type(*obj)
-        return field.python_type(obj)
+def _decode_bool(obj: int | bytes) -> bool:
+    # Stored as an integer, but values written as json are also possible
+    if isinstance(obj, (bytes, str)):
+        return bool(orjson.loads(obj))
+    return bool(obj)
 
 
 def adapt_value(obj: ty.Any) -> ty.Any:
@@ -112,4 +162,10 @@ def adapt_value(obj: ty.Any) -> ty.Any:
     return obj
 
 
-__all__ = ["get_signature", "convert_value", "adapt_value", "Field"]
+__all__ = [
+    "get_signature",
+    "make_decoder",
+    "RowDecoder",
+    "adapt_value",
+    "Field",
+]
@@ -0,0 +1,351 @@
+"""
+
+Manifest of the library.
+
+Log of the `.abp` files stored in the root of the books folder
+(`MANIFEST_FILE_NAME`). Enabled by the `library_manifest` config field.
+Each line is a record of a book: path of its `.abp` relative to the books
+folder, modification time and size of the `.abp` and url of the book,
+or a record of the removed book. The last record of the path is actual.
+
+The library is loaded from the manifest by one sequential read instead
+of walking the books folder and reading every `.abp`. Only `.abp` files
+of the books missing in the database are read.
+Then the manifest is verified in background: the books folder is walked,
+only `.abp` files changed since their records are read
+(e.g. written by the downloader process), the differences are applied
+to the database and the manifest is rewritten.
+
+Records are appended by `storage_writer` after the whole `.abp` files
+are written. Patches (e.g. of the stop flag) don't change the records,
+changed files are found by the verification.
+The log is compacted when it has more outdated records than actual ones,
+on loading and when it grows twice since the last compaction.
+
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import typing as ty
+from dataclasses import dataclass
+from itertools import batched
+
+import orjson
+from loguru import logger
+from models.book import Book, dump_storage
+from models.codec import storage_decoder
+from tools import write_file_atomic
+
+MANIFEST_FILE_NAME = ".abp_manifest"
+# Outdated records allowed in addition to the actual ones before compacting
+COMPACT_THRESHOLD = 100
+# Bytes appended to the manifest before checking if it must be compacted
+COMPACT_SIZE_THRESHOLD = 64 * 1024
+
+# {"path": <.abp path>, "mtime": <ns>, "size": <bytes>, "url": <book url>}
+# or {"path": <.abp path>, "removed": True}
+Record = dict[str, ty.Any]
+
+
+@dataclass(slots=True)
+class StorageBook:
+    """
+    Book found in the books folder.
+    """
+
+    abp_file_path: str
+    url: str
+    book: Book | None = None  # None - not loaded from the `.abp` yet
+
+
+def load_books(
+    storage_books: ty.Iterable[StorageBook],
+) -> ty.Generator[Book, ty.Any, None]:
+    """
+    Loads the books from the `.abp` files if they aren't loaded yet.
+    Books which `.abp` can't be loaded are skipped.
+    """
+    not_loaded = []
+    for storage_book in storage_books:
+        if storage_book.book is not None:
+            yield storage_book.book
+        elif os.path.exists(storage_book.abp_file_path):
+            # The manifest can be outdated
+            not_loaded.append(storage_book.abp_file_path)
+    for __, book in storage_decoder.load_many(not_loaded):
+        if book is not None:
+            yield book
+
+
+class LibraryManifest:
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Size of the manifest after the last check of compaction
+        self._checked_size = 0
+
+    @property
+    def enabled(self) -> bool:
+        return os.environ.get("library_manifest") == "1"
+
+    @staticmethod
+    def manifest_path(books_folder: str) -> str:
+        return os.path.join(books_folder, MANIFEST_FILE_NAME)
+
+    def load_library(
+        self, books_folder: str
+    ) -> tuple[list[StorageBook], bool]:
+        """
+        Loads the books from the manifest.
+        If there is no manifest, the books folder is scanned
+        and the manifest is created.
+        :returns: Books and True if they are loaded from the manifest
+            (the manifest has to be verified, books have to be loaded
+            by `load_books`).
+        """
+        if (records := self.load(books_folder)) is not None:
+            books = [
+                StorageBook(os.path.join(books_folder, path), record["url"])
+                for path, record in records.items()
+            ]
+            logger.opt(colors=True).debug(
+                f"<y>{len(books)}</y> books loaded from the manifest"
+            )
+            return books, True
+
+        books = [
+            StorageBook(book.abp_file_path, book.url, book)
+            for book in Book.scan_dir(books_folder)
+        ]
+        self.write(
+            books_folder,
+            {
+                record["path"]: record
+                for book in books
+                if (
+                    record := _make_record(
+                        books_folder, book.abp_file_path, book.url
+                    )
+                )
+            },
+        )
+        return books, False
+
+    def load(self, books_folder: str) -> dict[str, Record] | None:
+        """
+        :returns: Actual records {<.abp path>: <record>}.
+            None - the manifest is disabled or missing.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            try:
+                with open(self.manifest_path(books_folder), "rb") as file:
+                    content = file.read()
+            except FileNotFoundError:
+                return None
+            records: dict[str, Record] = {}
+            lines = 0
+            for line in content.splitlines():
+                try:
+                    record = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Interrupted append
+                    continue
+                lines += 1
+                if not record.get("removed") and "url" not in record:
+                    # Record of the earlier format
+                    continue
+                if record.get("removed"):
+                    records.pop(record["path"], None)
+                else:
+                    records[record["path"]] = record
+            if lines - len(records) > len(records) + COMPACT_THRESHOLD:
+                self.write(books_folder, records)
+            else:
+                self._checked_size = len(content)
+        return records
+
+    def write(self, books_folder: str, records: dict[str, Record]) -> None:
+        """
+        Rewrites the manifest with the records.
+        """
+        if not self.enabled:
+            return
+        content = b"".join(
+            dump_storage(record) + b"\n" for record in records.values()
+        )
+        with self._lock:
+            write_file_atomic(self.manifest_path(books_folder), content)
+            self._checked_size = len(content)
+        logger.opt(colors=True).debug(
+            f"manifest written: <y>{len(records)}</y> books"
+        )
+
+    def put(self, files: ty.Iterable[tuple[str, str]]) -> None:
+        """
+        Records the written `.abp` files.
+        :param files: [(<.abp path>, <book url>), ...]
+        """
+        if not self.enabled:
+            return
+        books_folder = os.environ["books_folder"]
+        self._append(
+            record
+            for file_path, url in files
+            if (record := _make_record(books_folder, file_path, url))
+        )
+
+    def remove(self, book: Book) -> None:
+        """
+        Records the removed `.abp` of the book.
+        """
+        if not self.enabled:
+            return
+        books_folder = os.environ["books_folder"]
+        if path := _relative_path(books_folder, book.abp_file_path):
+            self._append([dict(path=path, removed=True)])
+
+    def _append(self, records: ty.Iterable[Record]) -> None:
+        content = b"".join(dump_storage(record) + b"\n" for record in records)
+        if not content:
+            return
+        books_folder = os.environ["books_folder"]
+        with self._lock:
+            if not os.path.exists(self.manifest_path(books_folder)):
+                # Created by loading the library
+                return
+            try:
+                with open(self.manifest_path(books_folder), "ab") as file:
+                    file.write(content)
+                    size = file.tell()
+            except IOError as err:
+                logger.opt(colors=True).error(
+                    f"failed to append the manifest. "
+                    f"<lr>{type(err).__name__}: {err}</lr>"
+                )
+                return
+            if size > 2 * self._checked_size + COMPACT_SIZE_THRESHOLD:
+                # Compacted by loading if required
+                self.load(books_folder)
+                self._checked_size = max(self._checked_size, size)
+
+    def verify_in_background(self, books_folder: str) -> None:
+        """
+        Starts the verification of the manifest.
+        """
+        threading.Thread(
+            target=self.verify,
+            args=(books_folder,),
+            name="manifest_verification",
+            daemon=True,
+        ).start()
+
+    @logger.catch
+    def verify(self, books_folder: str) -> None:
+        """
+        Reads the `.abp` files changed since the manifest records,
+        applies the differences to the database and rewrites the manifest.
+        """
+        from .core import IMPORT_BATCH_SIZE, Database
+
+        logger.debug("verifying the manifest")
+        records = self.load(books_folder) or {}
+        seen: set[str] = set()
+
+        def _unchanged(abp_path: str) -> bool:
+            seen.add(path := os.path.relpath(abp_path, books_folder))
+            try:
+                stat = os.stat(abp_path)
+            except OSError:
+                return False
+            return (
+                path in records
+                and records[path]["mtime"] == stat.st_mtime_ns
+                and records[path]["size"] == stat.st_size
+            )
+
+        changed = list(Book.scan_dir(books_folder, skip=_unchanged))
+        changed_urls = {book.url for book in changed}
+        removed = [
+            records[path]
+            for path in records.keys() - seen
+            if not os.path.exists(os.path.join(books_folder, path))
+        ]
+        moved = {
+            record["url"]
+            for record in removed
+            if record["url"] in changed_urls
+        }
+        if not changed and not removed:
+            logger.debug("manifest verified, no changes")
+            return
+
+        with Database() as db:
+            added_books = 0
+            for batch in batched(changed, IMPORT_BATCH_SIZE):
+                added_books += db.import_books(batch)
+            removed_books = []
+            for batch in batched(removed, IMPORT_BATCH_SIZE):
+                for url in db.check_is_books_exists(
+                    [
+                        record["url"]
+                        for record in batch
+                        if record["url"] not in moved
+                    ],
+                    downloaded=True,
+                ):
+                    removed_books.append(db.get_book_by_url(url).id)
+            if removed_books:
+                # `.abp` files were deleted outside the application
+                db.clear_files(*removed_books)
+            db.commit()
+        logger.opt(colors=True).debug(
+            f"manifest verified. changed: <y>{len(changed)}</y> "
+            f"(<y>{added_books}</y> added to library), "
+            f"removed: <y>{len(removed)}</y> "
+            f"(<y>{len(removed_books)}</y> files cleared)"
+        )
+
+        with self._lock:
+            # Records appended during the verification are kept
+            records = self.load(books_folder) or {}
+            for book in changed:
+                if record := _make_record(
+                    books_folder, book.abp_file_path, book.url
+                ):
+                    current = records.get(record["path"])
+                    if current is None or current["mtime"] <= record["mtime"]:
+                        records[record["path"]] = record
+            for record in removed:
+                if records.get(record["path"]) == record:
+                    del records[record["path"]]
+            self.write(books_folder, records)
+
+
+def _relative_path(books_folder: str, file_path: str) -> str | None:
+    """
+    :returns: Path relative to the books folder.
+        None - the file is outside the books folder.
+    """
+    path = os.path.relpath(file_path, books_folder)
+    if path.startswith(os.pardir):
+        return None
+    return path
+
+
+def _make_record(books_folder: str, file_path: str, url: str) -> Record | None:
+    """
+    :returns: Record of the `.abp` or None if it can't be recorded.
+    """
+    if not (path := _relative_path(books_folder, file_path)):
+        return None
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return dict(path=path, mtime=stat.st_mtime_ns, size=stat.st_size, url=url)
+
+
+library_manifest = LibraryManifest()
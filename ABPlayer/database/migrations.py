@@ -0,0 +1,576 @@
+"""
+
+Versioned migrations of the database schema.
+
+The version of the schema is stored in `PRAGMA user_version`.
+On start only the migrations newer than the stored version are applied,
+so the schema isn't inspected at all when it is up to date.
+
+Schema changes of a migration are applied in one transaction.
+Values of the existing rows are calculated in chunks by id (backfill),
+each chunk is committed separately, so large libraries don't hold
+the write lock for long. The version is updated after the backfill.
+An interrupted migration is applied again on the next start,
+so schema changes must be idempotent and the backfill
+must skip the rows that are already calculated.
+
+To change the schema add a migration to the end of `MIGRATIONS`.
+Applied migrations must never be changed, so the schema of each
+migration is copied into its own constants (`*_V<version>`)
+instead of being built from the current declarations: a given
+`user_version` always means the same schema.
+
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import typing as ty
+from contextlib import contextmanager
+from dataclasses import dataclass
+from functools import partial
+
+from loguru import logger
+
+from .core import _parse_duration
+
+BACKFILL_CHUNK_SIZE = 1000  # Rows calculated in one transaction
+
+# Columns of the books table (version 1).
+# {<column>: (<SQL type>, <default value of the added column>)}
+BOOKS_COLUMNS_V1 = {
+    "author": ("TEXT", ""),
+    "name": ("TEXT", ""),
+    "series_name": ("TEXT", ""),
+    "number_in_series": ("TEXT", ""),
+    "description": ("TEXT", ""),
+    "reader": ("TEXT", ""),
+    "duration": ("TEXT", ""),
+    "url": ("TEXT", ""),
+    "preview": ("TEXT", ""),
+    "driver": ("TEXT", ""),
+    "items": ("json", b"[]"),
+    "status": ("TEXT", "new"),
+    "stop_flag": ("json", b'{"item":0,"time":0}'),
+    "favorite": ("json", 0),
+    "files": ("json", b"{}"),
+    "adding_date": ("datetime", b"2007-05-23 00:00:00"),
+    "multi_readers": ("json", 0),
+}
+# Columns calculated by the database (version 2). {<column>: <SQL type>}
+DERIVED_COLUMNS_V2 = {
+    "duration_sec": "INTEGER",  # Duration of the chapters (in seconds)
+    "listened_sec": "INTEGER",  # Listened time (in seconds)
+    "progress_pct": "INTEGER",  # Listening progress (in percentage)
+    "downloaded": "INTEGER",  # 1 - the book files are downloaded
+}
+# Statements calculating the derived columns (in this order, version 2).
+# Same as `Book.listening_progress`, but without loading the chapters.
+# If the chapters have no duration, the parsed `duration` is kept
+DERIVED_COLUMNS_UPDATES_V2 = (
+    "UPDATE books SET duration_sec = coalesce(nullif(("
+    "SELECT total(json_extract(item.value, '$.end_time')"
+    " - json_extract(item.value, '$.start_time')) "
+    "FROM json_each(CAST(books.items AS TEXT)) AS item"
+    "), 0), duration_sec, 0) "
+    "WHERE %s",
+    "UPDATE books SET listened_sec = CASE WHEN status = 'finished' "
+    "THEN duration_sec ELSE CAST(("
+    "SELECT total(CASE WHEN item.key < "
+    "json_extract(CAST(books.stop_flag AS TEXT), '$.item') "
+    "THEN json_extract(item.value, '$.end_time')"
+    " - json_extract(item.value, '$.start_time') END) "
+    "FROM json_each(CAST(books.items AS TEXT)) AS item"
+    ") + coalesce(json_extract(CAST(books.stop_flag AS TEXT), '$.time'), 0) "
+    "AS INTEGER) END "
+    "WHERE %s",
+    "UPDATE books SET progress_pct = CASE WHEN status = 'finished' THEN 100 "
+    "ELSE coalesce("
+    "CAST(round(listened_sec * 100.0 / nullif(duration_sec, 0)) AS INTEGER), 0"
+    ") END "
+    "WHERE %s",
+    "UPDATE books SET downloaded = length(files) > 2 WHERE %s",
+)
+# Triggers maintaining the derived columns (version 2).
+# {<trigger name>: <event>}
+DERIVED_COLUMNS_TRIGGERS_V2 = {
+    "books_derived_insert": "INSERT",
+    "books_derived_update": "UPDATE OF duration, items, status, stop_flag, files",
+}
+# Indexes of the books table (version 3). {<index name>: <indexed columns>}
+INDEXES_V3 = {
+    "books_url_idx": "url",
+    "books_author_name_idx": "author, name",
+    # Cover grouping of the facets
+    "books_author_facet_idx": "author, duration_sec, downloaded",
+    "books_series_facet_idx": "series_name, duration_sec, downloaded",
+    "books_favorite_idx": "favorite, adding_date",
+    # Covers filtering and ordering of the default library listing
+    "books_adding_date_idx": "adding_date, id",
+    "books_status_adding_date_idx": "status, adding_date, id",
+    "books_duration_idx": "duration_sec, id",
+}
+# Columns of the full-text search index (version 4)
+SEARCH_INDEX_COLUMNS_V4 = ("name", "author", "series_name", "reader")
+# Unique index of the urls (version 5).
+# (<indexed columns>, <condition of the indexed rows>).
+# Books are imported by url. Local books may have no url
+URL_INDEX_V5 = ("url", "url != ''")
+# Statements calculating the derived columns (version 6).
+# The chapters are read once for all columns. The progress is calculated
+# from the not truncated listened time and rounded half up,
+# same as `Book.listening_progress`
+DERIVED_COLUMNS_UPDATES_V6 = (
+    "UPDATE books SET (duration_sec, listened_sec, progress_pct) = ("
+    "SELECT duration, "
+    "CASE WHEN books.status = 'finished' THEN duration "
+    "ELSE CAST(listened AS INTEGER) END, "
+    "CASE WHEN books.status = 'finished' THEN 100 ELSE coalesce("
+    "CAST(listened * 100.0 / nullif(duration, 0) + 0.5 AS INTEGER), 0"
+    ") END "
+    "FROM (SELECT coalesce(nullif(total("
+    "json_extract(item.value, '$.end_time')"
+    " - json_extract(item.value, '$.start_time')"
+    "), 0), books.duration_sec, 0) AS duration, "
+    "total(CASE WHEN item.key < "
+    "json_extract(CAST(books.stop_flag AS TEXT), '$.item') "
+    "THEN json_extract(item.value, '$.end_time')"
+    " - json_extract(item.value, '$.start_time') END"
+    ") + coalesce(json_extract(CAST(books.stop_flag AS TEXT), '$.time'), 0) "
+    "AS listened "
+    "FROM json_each(CAST(books.items AS TEXT)) AS item)"
+    ") WHERE %s",
+    "UPDATE books SET downloaded = length(files) > 2 WHERE %s",
+)
+# Statuses of the book from the earliest to the furthest
+STATUS_ORDER = ("new", "started", "finished")
+
+
+@dataclass
+class Migration:
+    description: str
+    # Applies schema changes. Called inside a transaction
+    upgrade: ty.Callable[[sqlite3.Connection], None]
+    # Calculates values of the rows with ids in the given range.
+    # Called inside a transaction for each chunk.
+    # Returns the number of calculated rows
+    backfill: ty.Callable[[sqlite3.Connection, int, int], int] | None = None
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """
+    Applies the migrations newer than the schema version of the database.
+    :returns: Schema version of the database.
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version > len(MIGRATIONS):
+        logger.warning(
+            f"database schema version {version} is newer than supported "
+            f"{len(MIGRATIONS)}"
+        )
+        return version
+    for version, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.opt(colors=True).debug(
+            f"applying migration <y>{version}</y>: {migration.description}"
+        )
+        with _transaction(conn):
+            migration.upgrade(conn)
+        if migration.backfill is not None:
+            _backfill(conn, migration.backfill)
+        with _transaction(conn):
+            conn.execute(f"PRAGMA user_version = {version}")
+    return version
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection) -> ty.Iterator[None]:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def _backfill(
+    conn: sqlite3.Connection,
+    backfill: ty.Callable[[sqlite3.Connection, int, int], int],
+) -> None:
+    first_id, last_id = conn.execute(
+        "SELECT min(id), max(id) FROM books"
+    ).fetchone()
+    if first_id is None:
+        return
+    rows = 0
+    for start in range(first_id, last_id + 1, BACKFILL_CHUNK_SIZE):
+        with _transaction(conn):
+            rows += backfill(conn, start, start + BACKFILL_CHUNK_SIZE - 1)
+    logger.opt(colors=True).debug(f"backfilled <y>{rows}</y> rows")
+
+
+def _table_columns(conn: sqlite3.Connection) -> set[str]:
+    return {column[1] for column in conn.execute("PRAGMA table_info(books)")}
+
+
+def sync_columns(
+    conn: sqlite3.Connection,
+    columns: dict[str, tuple[str, ty.Any]],
+    kept_columns: ty.Iterable[str] = (),
+) -> None:
+    """
+    Creates the books table or brings its columns in line with the given.
+    New columns get the given default values as column defaults,
+    so the existing rows aren't rewritten.
+    :param columns: {<column>: (<SQL type>, <default value>)}
+    :param kept_columns: Columns that aren't deleted
+        although they aren't given.
+    """
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS books "
+        "(id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, %s)"
+        % ", ".join(
+            f"{column} {sql_type}"
+            for column, (sql_type, __) in columns.items()
+        )
+    )
+    exists_columns = _table_columns(conn)
+    columns_to_add = [
+        column for column in columns if column not in exists_columns
+    ]
+    columns_to_delete = [
+        column
+        for column in exists_columns
+        if column != "id"
+        and column not in columns
+        and column not in kept_columns
+    ]
+    if columns_to_delete:
+        # Indexed columns can't be dropped.
+        # Indexes are recreated by the following migrations
+        for (index_name,) in conn.execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type='index' AND tbl_name='books' AND sql IS NOT NULL"
+        ).fetchall():
+            conn.execute(f"DROP INDEX {index_name}")
+    for column in columns_to_delete:
+        conn.execute(f"ALTER TABLE books DROP COLUMN {column}")
+    for column in columns_to_add:
+        sql_type, default = columns[column]
+        (default,) = conn.execute("SELECT quote(?)", (default,)).fetchone()
+        conn.execute(
+            f"ALTER TABLE books ADD COLUMN {column} {sql_type} DEFAULT {default}"
+        )
+    if columns_to_delete or columns_to_add:
+        logger.debug(
+            f"Columns {columns_to_delete} deleted; Columns {columns_to_add} added"
+        )
+
+
+def _merge_duplicates(
+    conn: sqlite3.Connection, columns: str, condition: str
+) -> None:
+    """
+    Merges the rows violating the unique index into the earliest one,
+    so the listening state of the duplicates isn't lost.
+    The kept row gets the furthest status and position of the rows,
+    favorite if any of them is favorite and the files of the earliest
+    downloaded one. The time of the position isn't stored,
+    so the furthest position is taken as the latest.
+    """
+    groups = conn.execute(
+        f"SELECT group_concat(id) FROM books WHERE {condition} "
+        f"GROUP BY {columns} HAVING count(*) > 1"
+    ).fetchall()
+    for (bids,) in groups:
+        bids = sorted(map(int, bids.split(",")))
+        rows = conn.execute(
+            "SELECT id, status, stop_flag, favorite, files, listened_sec "
+            f"FROM books WHERE id IN ({', '.join(map(str, bids))})"
+        ).fetchall()
+        __, status, stop_flag, __, __, __ = max(
+            rows,
+            key=lambda row: (
+                STATUS_ORDER.index(row[1]) if row[1] in STATUS_ORDER else 0,
+                row[5] or 0,
+                row[0],
+            ),
+        )
+        favorite = max(row[3] for row in rows)
+        files = next(
+            (
+                row[4]
+                for row in sorted(rows)
+                if row[4] is not None and len(row[4]) > 2
+            ),
+            None,
+        )
+        conn.execute(
+            "UPDATE books SET status=?, stop_flag=?, favorite=?, "
+            "files=coalesce(?, files) WHERE id=?",
+            (status, stop_flag, favorite, files, bids[0]),
+        )
+        conn.execute(
+            f"DELETE FROM books WHERE id IN ({', '.join(map(str, bids[1:]))})"
+        )
+        logger.opt(colors=True).debug(
+            f"books <y>{bids[1:]}</y> merged into <y>{bids[0]}</y> "
+            f"(same <y>{columns}</y>)"
+        )
+
+
+def sync_indexes(conn: sqlite3.Connection, indexes: dict[str, str]) -> None:
+    """
+    Creates missing indexes, recreates changed ones
+    and drops ones that are no longer used.
+    :param indexes: {<index name>: <indexed columns>}
+    """
+    exists_indexes = dict(
+        conn.execute(
+            "SELECT name, sql FROM sqlite_master "
+            "WHERE type='index' AND tbl_name='books' AND sql IS NOT NULL"
+        ).fetchall()
+    )
+    indexes = {
+        index_name: f"CREATE INDEX {index_name} ON books ({columns})"
+        for index_name, columns in indexes.items()
+    }
+    dropped_indexes = []
+    created_indexes = []
+    for index_name, sql in exists_indexes.items():
+        if indexes.get(index_name) != sql:
+            conn.execute(f"DROP INDEX {index_name}")
+            dropped_indexes.append(index_name)
+    for index_name, sql in indexes.items():
+        if exists_indexes.get(index_name) != sql:
+            conn.execute(sql)
+            created_indexes.append(index_name)
+    if dropped_indexes or created_indexes:
+        logger.debug(
+            f"Indexes {dropped_indexes} dropped; "
+            f"Indexes {created_indexes} created"
+        )
+
+
+def create_unique_index(
+    conn: sqlite3.Connection, index_name: str, columns: str, condition: str
+) -> None:
+    """
+    (Re)creates the partial unique index.
+    Rows violating it are merged first.
+    """
+    conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+    _merge_duplicates(conn, columns, condition)
+    conn.execute(
+        f"CREATE UNIQUE INDEX {index_name} ON books ({columns}) "
+        f"WHERE {condition}"
+    )
+    logger.debug(f"Unique index {index_name} created")
+
+
+def sync_derived_columns(
+    conn: sqlite3.Connection,
+    columns: dict[str, str],
+    updates: tuple[str, ...],
+    triggers: dict[str, str],
+) -> None:
+    """
+    Adds the derived columns and (re)creates the triggers maintaining them.
+    :param columns: {<column>: <SQL type>}
+    :param updates: Statements calculating the columns
+        with the placeholder of the condition.
+    :param triggers: {<trigger name>: <event>}
+    """
+    exists_columns = _table_columns(conn)
+    for column, sql_type in columns.items():
+        if column not in exists_columns:
+            conn.execute(f"ALTER TABLE books ADD COLUMN {column} {sql_type}")
+    body = " ".join(f"{update % 'id = NEW.id'};" for update in updates)
+    for name, event in triggers.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(
+            f"CREATE TRIGGER {name} AFTER {event} ON books BEGIN {body} END"
+        )
+
+
+def backfill_derived_columns(
+    conn: sqlite3.Connection,
+    first_id: int,
+    last_id: int,
+    columns: ty.Iterable[str],
+    updates: tuple[str, ...],
+) -> int:
+    """
+    Calculates the derived columns of the books that don't have them yet.
+    """
+    not_calculated = "(%s) AND id BETWEEN %d AND %d" % (
+        " OR ".join(f"{column} IS NULL" for column in columns),
+        first_id,
+        last_id,
+    )
+    rows = conn.execute(
+        f"SELECT id, duration FROM books WHERE {not_calculated}"
+    ).fetchall()
+    if rows:
+        conn.executemany(
+            "UPDATE books SET duration_sec=? WHERE id=?",
+            [(_parse_duration(duration), bid) for bid, duration in rows],
+        )
+        for update in updates:
+            conn.execute(update % not_calculated)
+    return len(rows)
+
+
+def recalculate_derived_columns(
+    conn: sqlite3.Connection,
+    first_id: int,
+    last_id: int,
+    updates: tuple[str, ...],
+) -> int:
+    """
+    Calculates the derived columns of all books again.
+    """
+    for update in updates:
+        conn.execute(update % f"id BETWEEN {first_id} AND {last_id}")
+    return conn.execute(
+        "SELECT count(*) FROM books WHERE id BETWEEN ? AND ?",
+        (first_id, last_id),
+    ).fetchone()[0]
+
+
+def _fts_available(conn: sqlite3.Connection) -> bool:
+    return bool(
+        conn.execute(
+            "SELECT sqlite_compileoption_used('ENABLE_FTS5')"
+        ).fetchone()[0]
+    )
+
+
+def _normalize_sql(value: str) -> str:
+    """
+    SQL expression normalizing the value for the search index.
+    The tokenizer folds the case, but doesn't treat `ё` as `е`.
+    """
+    return f"replace(replace({value}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_search_index(
+    conn: sqlite3.Connection, search_columns: tuple[str, ...]
+) -> None:
+    """
+    Creates the full-text search index of the library (FTS5).
+    The index is kept in sync with `books` by triggers.
+    """
+    if not _fts_available(conn):
+        logger.warning("FTS5 is not supported. search index not created")
+        return
+    columns = ", ".join(search_columns)
+    new_values = ", ".join(
+        _normalize_sql(f"new.{column}") for column in search_columns
+    )
+    old_values = ", ".join(
+        _normalize_sql(f"old.{column}") for column in search_columns
+    )
+    # Filled from scratch by the backfill
+    conn.execute("DROP TABLE IF EXISTS books_fts")
+    # Contentless table: normalized values are stored only in the index
+    conn.execute(
+        f"CREATE VIRTUAL TABLE books_fts USING fts5({columns}, "
+        "content='', tokenize='unicode61 remove_diacritics 2')"
+    )
+    conn.execute("DROP TRIGGER IF EXISTS books_fts_insert")
+    conn.execute(
+        "CREATE TRIGGER books_fts_insert AFTER INSERT ON books BEGIN "
+        f"INSERT INTO books_fts(rowid, {columns}) "
+        f"VALUES (new.id, {new_values}); END"
+    )
+    conn.execute("DROP TRIGGER IF EXISTS books_fts_delete")
+    conn.execute(
+        "CREATE TRIGGER books_fts_delete AFTER DELETE ON books BEGIN "
+        f"INSERT INTO books_fts(books_fts, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values}); END"
+    )
+    conn.execute("DROP TRIGGER IF EXISTS books_fts_update")
+    conn.execute(
+        f"CREATE TRIGGER books_fts_update AFTER UPDATE OF {columns} "
+        "ON books BEGIN "
+        f"INSERT INTO books_fts(books_fts, rowid, {columns}) "
+        f"VALUES ('delete', old.id, {old_values}); "
+        f"INSERT INTO books_fts(rowid, {columns}) "
+        f"VALUES (new.id, {new_values}); END"
+    )
+
+
+def backfill_search_index(
+    conn: sqlite3.Connection,
+    first_id: int,
+    last_id: int,
+    search_columns: tuple[str, ...],
+) -> int:
+    if not _fts_available(conn):
+        return 0
+    columns = ", ".join(search_columns)
+    values = ", ".join(_normalize_sql(column) for column in search_columns)
+    return conn.execute(
+        f"INSERT INTO books_fts(rowid, {columns}) "
+        f"SELECT id, {values} FROM books WHERE id BETWEEN ? AND ?",
+        (first_id, last_id),
+    ).rowcount
+
+
+# Migrations in the order of applying.
+# Version of the schema is the number of applied migrations
+MIGRATIONS = [
+    # Databases created before the migrations have version 0
+    # and any of the earlier schemas, so the first migrations
+    # bring them in line with the declared one
+    Migration(
+        "books table",
+        partial(
+            sync_columns,
+            columns=BOOKS_COLUMNS_V1,
+            kept_columns=DERIVED_COLUMNS_V2,
+        ),
+    ),
+    Migration(
+        "derived columns",
+        partial(
+            sync_derived_columns,
+            columns=DERIVED_COLUMNS_V2,
+            updates=DERIVED_COLUMNS_UPDATES_V2,
+            triggers=DERIVED_COLUMNS_TRIGGERS_V2,
+        ),
+        partial(
+            backfill_derived_columns,
+            columns=DERIVED_COLUMNS_V2,
+            updates=DERIVED_COLUMNS_UPDATES_V2,
+        ),
+    ),
+    Migration("indexes", partial(sync_indexes, indexes=INDEXES_V3)),
+    Migration(
+        "search index",
+        partial(create_search_index, search_columns=SEARCH_INDEX_COLUMNS_V4),
+        partial(backfill_search_index, search_columns=SEARCH_INDEX_COLUMNS_V4),
+    ),
+    Migration(
+        "unique books urls",
+        partial(
+            create_unique_index,
+            index_name="books_url_idx",
+            columns=URL_INDEX_V5[0],
+            condition=URL_INDEX_V5[1],
+        ),
+    ),
+    Migration(
+        "progress rounding",
+        partial(
+            sync_derived_columns,
+            columns=DERIVED_COLUMNS_V2,
+            updates=DERIVED_COLUMNS_UPDATES_V6,
+            triggers=DERIVED_COLUMNS_TRIGGERS_V2,
+        ),
+        partial(
+            recalculate_derived_columns, updates=DERIVED_COLUMNS_UPDATES_V6
+        ),
+    ),
+]
@@ -0,0 +1,154 @@
+"""
+
+Instrumentation of the database queries.
+
+Enabled if the `PROFILE_QUERIES` environment variable is set.
+Execution time (including fetching) and the number of rows are recorded
+for each statement executed by `Database`. Statements are grouped
+by their shape: the query with collapsed whitespace, placeholder lists
+and numbers, so the same query with different arguments is one shape.
+
+Statements slower than `SLOW_QUERY_THRESHOLD` milliseconds
+are logged with their `EXPLAIN QUERY PLAN`.
+Aggregated stats are available through `DebugApi.get_query_stats`.
+
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import typing as ty
+from collections import deque
+
+from loguru import logger
+
+# Statements slower than this (in milliseconds) are logged
+SLOW_QUERY_THRESHOLD = float(os.environ.get("SLOW_QUERY_THRESHOLD", 100))
+# Durations kept per shape to calculate the percentiles
+SAMPLES_LIMIT = 1000
+# Statements which query plan can be explained
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+_WHITESPACE = re.compile(r"\s+")
+_PLACEHOLDERS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_NUMBERS = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+
+
+def query_shape(query: str) -> str:
+    """
+    :returns: Query without the values that differ between the calls.
+    """
+    query = _WHITESPACE.sub(" ", query).strip()
+    query = _PLACEHOLDERS.sub("(?, ...)", query)
+    return _NUMBERS.sub("?", query)
+
+
+def explain(conn: sqlite3.Connection, query: str, args: ty.Sequence) -> str:
+    """
+    :returns: Query plan of the statement as a tree.
+    """
+    if not query.lstrip().upper().startswith(EXPLAINABLE):
+        return ""
+    try:
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", args).fetchall()
+    except sqlite3.Error as err:
+        return f"failed to explain. {type(err).__name__}: {err}"
+    depths = {0: -1}
+    lines = []
+    for node_id, parent_id, __, detail in plan:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        lines.append(f"{'  ' * depths[node_id]}{detail}")
+    return "\n".join(lines)
+
+
+class QueryStats:
+    __slots__ = ("count", "rows", "total_time", "max_time", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.samples: deque[float] = deque(maxlen=SAMPLES_LIMIT)
+
+    def add(self, duration: float, rows: int) -> None:
+        self.count += 1
+        self.rows += max(rows, 0)
+        self.total_time += duration
+        self.max_time = max(self.max_time, duration)
+        self.samples.append(duration)
+
+    def percentile(self, p: float) -> float:
+        samples = sorted(self.samples)
+        return samples[round(p * (len(samples) - 1))]
+
+
+class QueryProfiler:
+    def __init__(self, enabled: bool, slow_threshold: float):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold / 1000
+        self._stats: dict[str, QueryStats] = {}  # {<query shape>: <stats>}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        conn: sqlite3.Connection,
+        query: str,
+        args: ty.Sequence,
+        start_time: float,
+        rows: int,
+    ) -> None:
+        """
+        Records the statement executed since `start_time`.
+        :param args: Arguments of the statement (of the first row
+            for executemany).
+        :param rows: Fetched or changed rows.
+        """
+        duration = time.perf_counter() - start_time
+        shape = query_shape(query)
+        with self._lock:
+            if (stats := self._stats.get(shape)) is None:
+                stats = self._stats[shape] = QueryStats()
+            stats.add(duration, rows)
+        if duration >= self.slow_threshold:
+            # The query is passed as argument, so `<` isn't taken as a tag
+            logger.opt(colors=True).warning(
+                f"slow query <y>{round(duration * 1000, 1)}</y>ms "
+                f"(<y>{rows}</y> rows): {{}}\n{{}}",
+                shape,
+                explain(conn, query, args),
+            )
+
+    def stats(self) -> list[dict[str, ty.Any]]:
+        """
+        :returns: Stats of the query shapes, the most time-consuming first.
+            Times are in milliseconds.
+        """
+        with self._lock:
+            stats = [
+                dict(
+                    query=shape,
+                    count=stats.count,
+                    rows=stats.rows,
+                    total=round(stats.total_time * 1000, 3),
+                    p50=round(stats.percentile(0.5) * 1000, 3),
+                    p95=round(stats.percentile(0.95) * 1000, 3),
+                    max=round(stats.max_time * 1000, 3),
+                )
+                for shape, stats in self._stats.items()
+            ]
+        return sorted(stats, key=lambda shape: shape["total"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+query_profiler = QueryProfiler(
+    enabled=bool(os.environ.get("PROFILE_QUERIES")),
+    slow_threshold=SLOW_QUERY_THRESHOLD,
+)
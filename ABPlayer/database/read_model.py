@@ -0,0 +1,324 @@
+"""
+
+In-memory read model of the library list.
+
+Cards of all books (`BookCard`, slotted records) are loaded once
+and the library list is filtered, sorted and paged without queries.
+Books of each sorting are kept ordered by (sort key, id),
+so a page is found by bisection like the keyset pagination of SQL.
+
+The model is kept in sync with the database:
+- write methods of `Database` mark the changed books as dirty,
+  their cards are reloaded before the next read
+  (uncommitted changes of the process are visible, as for queries);
+- a rolled back transaction invalidates the model;
+- changes committed by another process (the downloader)
+  are detected by `PRAGMA data_version` and reload the model.
+
+The model is accessed only inside `with Database()` blocks,
+so it is guarded by the lock of `Database`.
+
+In debug mode (`DEBUG` environment variable) each page served
+by the model is compared with the same page queried from the database.
+
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import typing as ty
+from bisect import bisect_left, bisect_right
+
+from loguru import logger
+from models.book import DATETIME_FORMAT, BookCard
+
+if ty.TYPE_CHECKING:
+    from .core import Database
+
+DEBUG = bool(os.environ.get("DEBUG"))
+# Dirty books reloaded by one query. If there are more, all are reloaded
+REFRESH_LIMIT = 500
+
+_REAL_PREFIX = re.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+
+def _sql_real(value: str) -> float:
+    """
+    Same as `CAST(value AS REAL)` of SQLite: the numeric prefix or 0.
+    """
+    if match := _REAL_PREFIX.match(value or ""):
+        return float(match.group())
+    return 0.0
+
+
+# Sort keys of the sortings from `LIBRARY_SORTS`.
+# Keys are the same values as the database returns in the cursor.
+# {<sort>: <function (card, duration in seconds) -> sort key>}
+SORT_KEYS: dict[str, ty.Callable[[BookCard, int | None], ty.Any]] = {
+    "adding_date": lambda card, __: (
+        card.adding_date.strftime(DATETIME_FORMAT)
+        if card.adding_date is not None
+        else ""
+    ),
+    "cast(number_in_series as real)": lambda card, __: _sql_real(
+        card.number_in_series
+    ),
+    "duration_sec": lambda __, duration_sec: duration_sec or 0,
+}
+# Filters served by the sets of books with the same value.
+# {<filter>: <function (card) -> value>}
+INDEXED_FILTERS: dict[str, ty.Callable[[BookCard], ty.Any]] = {
+    "author": lambda card: card.author,
+    "series": lambda card: card.series_name,
+    "favorite": lambda card: bool(card.favorite),
+    # Status is None if it can't be decoded
+    "status": lambda card: (
+        card.status.value if card.status is not None else None
+    ),
+}
+
+
+class LibraryModel:
+    def __init__(self):
+        self.loaded = False
+        self._data_version: int | None = None
+        self._cards: dict[int, BookCard] = {}
+        # {<sort>: {<bid>: <sort key>}}
+        self._keys: dict[str, dict[int, ty.Any]] = {
+            sort: {} for sort in SORT_KEYS
+        }
+        # {<sort>: [(<sort key>, <bid>), ...] in ascending order}
+        # None - has to be sorted
+        self._orders: dict[str, list[tuple[ty.Any, int]] | None] = {}
+        self._dirty: set[int] = set()
+        # {<filter>: {<value>: {<bid>, ...}}}
+        self._indexes: dict[str, dict[ty.Any, set[int]]] = {
+            name: {} for name in INDEXED_FILTERS
+        }
+
+    def mark_dirty(self, *bids: int) -> None:
+        """
+        Cards of the books will be reloaded before the next read.
+        """
+        if self.loaded:
+            self._dirty.update(bids)
+
+    def invalidate(self) -> None:
+        """
+        The model will be reloaded before the next read.
+        """
+        self.loaded = False
+        self._dirty.clear()
+
+    def sync(self, db: Database) -> None:
+        """
+        Brings the model in line with the database.
+        """
+        data_version = db.get_data_version()
+        if not self.loaded or data_version != self._data_version:
+            self._load(db)
+        elif len(self._dirty) > REFRESH_LIMIT:
+            self._load(db)
+        elif self._dirty:
+            self._refresh(db)
+        self._data_version = data_version
+
+    def _load(self, db: Database) -> None:
+        self._cards.clear()
+        for index in self._indexes.values():
+            index.clear()
+        for keys in self._keys.values():
+            keys.clear()
+        for card, duration_sec in db.get_cards():
+            self._put(card, duration_sec)
+        self._orders = dict.fromkeys(SORT_KEYS)
+        self._dirty.clear()
+        self.loaded = True
+        logger.opt(colors=True).debug(
+            f"library model loaded: <y>{len(self._cards)}</y> books"
+        )
+
+    def _refresh(self, db: Database) -> None:
+        bids, self._dirty = self._dirty, set()
+        cards = db.get_cards(*bids)
+        old_keys = {
+            sort: {bid: keys.get(bid) for bid in bids}
+            for sort, keys in self._keys.items()
+        }
+        for bid in bids:
+            self._pop(bid)
+        for card, duration_sec in cards:
+            self._put(card, duration_sec)
+        for sort, keys in self._keys.items():
+            # Resorted only if the order has been changed
+            if any(keys.get(bid) != old_keys[sort][bid] for bid in bids):
+                self._orders[sort] = None
+
+    def _put(self, card: BookCard, duration_sec: int | None) -> None:
+        self._cards[card.id] = card
+        for name, value in INDEXED_FILTERS.items():
+            self._indexes[name].setdefault(value(card), set()).add(card.id)
+        for sort, key in SORT_KEYS.items():
+            self._keys[sort][card.id] = key(card, duration_sec)
+
+    def _pop(self, bid: int) -> None:
+        if (card := self._cards.pop(bid, None)) is None:
+            return
+        for name, value in INDEXED_FILTERS.items():
+            self._indexes[name][value(card)].discard(bid)
+        for keys in self._keys.values():
+            keys.pop(bid, None)
+
+    def _order(self, sort: str) -> list[tuple[ty.Any, int]]:
+        if (order := self._orders[sort]) is None:
+            order = self._orders[sort] = sorted(
+                (key, bid) for bid, key in self._keys[sort].items()
+            )
+        return order
+
+    def _filter(
+        self,
+        author: str | None,
+        series: str | None,
+        favorite: bool | None,
+        status: str | None,
+        bids: list[int] | None,
+        progress: tuple[int, int] | None,
+    ) -> tuple[set[int] | None, ty.Callable[[BookCard], bool] | None]:
+        """
+        :returns: Books that can match the filters
+            (None - all books) and the check of the progress
+            (None - not filtered by the progress).
+        """
+        subsets = [
+            self._indexes[name].get(value, set())
+            for name, value in (
+                ("author", author),
+                ("series", series),
+                ("favorite", None if favorite is None else bool(favorite)),
+                ("status", status),
+            )
+            if value is not None
+        ]
+        if bids is not None:
+            subsets.append(set(bids))
+        candidates = None
+        if subsets:
+            # Starting from the smallest set
+            subsets.sort(key=len)
+            candidates = subsets[0].intersection(*subsets[1:])
+
+        if progress is None:
+            return candidates, None
+        return candidates, (
+            lambda card: progress[0] <= card.progress <= progress[1]
+        )
+
+    def page(
+        self,
+        limit: int,
+        cursor: ty.Any,
+        sort: str,
+        reverse: bool,
+        author: str | None = None,
+        series: str | None = None,
+        favorite: bool | None = None,
+        status: str | None = None,
+        bids: list[int] | None = None,
+        progress: tuple[int, int] | None = None,
+    ) -> tuple[list[BookCard], ty.Any]:
+        """
+        Same as `Database.get_library_page`.
+        """
+        candidates, check = self._filter(
+            author, series, favorite, status, bids, progress
+        )
+        if candidates is not None and len(candidates) < len(self._cards) // 8:
+            # Few books, sorting them is cheaper than skipping others
+            keys = self._keys[sort]
+            order = sorted(
+                (keys[bid], bid) for bid in candidates if bid in keys
+            )
+            candidates = None
+        else:
+            order = self._order(sort)
+
+        if reverse:
+            end = (
+                len(order)
+                if cursor is None
+                else bisect_left(order, tuple(cursor))
+            )
+            positions = range(end - 1, -1, -1)
+        else:
+            start = 0 if cursor is None else bisect_right(order, tuple(cursor))
+            positions = range(start, len(order))
+
+        cards = []
+        for position in positions:
+            bid = order[position][1]
+            if candidates is not None and bid not in candidates:
+                continue
+            card = self._cards[bid]
+            if check is not None and not check(card):
+                continue
+            cards.append(card)
+            if len(cards) == limit:
+                return cards, list(order[position])
+        return cards, None
+
+    def count(
+        self,
+        author: str | None = None,
+        series: str | None = None,
+        favorite: bool | None = None,
+        status: str | None = None,
+        bids: list[int] | None = None,
+        progress: tuple[int, int] | None = None,
+    ) -> int:
+        """
+        Same as `Database.count_library`.
+        """
+        candidates, check = self._filter(
+            author, series, favorite, status, bids, progress
+        )
+        if candidates is None:
+            candidates = self._cards.keys()
+        else:
+            candidates = candidates & self._cards.keys()
+        if check is None:
+            return len(candidates)
+        return sum(1 for bid in candidates if check(self._cards[bid]))
+
+    def check(self, db: Database) -> list[int]:
+        """
+        Compares the model with the database.
+        :returns: Bids of the books which cards differ.
+        """
+        self.sync(db)
+        cards = {
+            card.id: (card, duration_sec)
+            for card, duration_sec in db.get_cards()
+        }
+        inconsistent = [
+            bid
+            for bid in cards.keys() | self._cards.keys()
+            if bid not in cards
+            or self._cards.get(bid) != cards[bid][0]
+            or self._keys["duration_sec"].get(bid)
+            != SORT_KEYS["duration_sec"](*cards[bid])
+        ]
+        for sort in SORT_KEYS:
+            if self._order(sort) != sorted(
+                (key, bid) for bid, key in self._keys[sort].items()
+            ):
+                logger.error(f"library model: order of {sort} is broken")
+        if inconsistent:
+            logger.error(
+                f"library model is inconsistent. bids: {inconsistent}"
+            )
+        return sorted(inconsistent)
+
+
+library_model = LibraryModel()
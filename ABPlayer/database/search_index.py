@@ -0,0 +1,138 @@
+"""
+
+In-memory trigram index of the library for typo-tolerant search.
+
+The index is built from the database on the first search
+and is updated by `Database` when books are added, saved or removed.
+Words are compared by their trigrams, so the search tolerates typos
+and works the same for Cyrillic and Latin.
+
+"""
+
+from __future__ import annotations
+
+import threading
+import typing as ty
+from collections import Counter
+
+from loguru import logger
+
+if ty.TYPE_CHECKING:
+    from models.book import Book
+
+# Fields of the book by which the search is performed
+SEARCH_FIELDS = ("author", "name", "series_name", "reader")
+
+
+def normalize(text: str) -> list[str]:
+    """
+    :returns: Words of the text prepared for indexing.
+    """
+    return text.lower().replace("ё", "е").split()
+
+
+def word_trigrams(word: str) -> set[str]:
+    """
+    :returns: Trigrams of the word padded with spaces.
+    """
+    word = f" {word} "
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+def book_keywords(book: Book) -> list[str]:
+    """
+    :returns: Words of the book fields by which the search is performed.
+    """
+    words = []
+    for field in SEARCH_FIELDS:
+        words.extend(normalize(getattr(book, field) or ""))
+    return words
+
+
+class TrigramIndex:
+    # The share of the query word trigrams that the book must contain
+    MIN_WORD_SCORE = 0.5
+
+    def __init__(self):
+        self.built = False
+        self._postings: dict[str, set[int]] = {}  # {<trigram>: {<bid>, ...}}
+        self._books_trigrams: dict[int, set[str]] = {}
+        self._lock = threading.RLock()
+
+    def build(self, books_keywords: dict[int, list[str]]) -> None:
+        """
+        Builds the index from scratch.
+        :param books_keywords: {<bid>: [<normalized word>, ...]}
+        """
+        with self._lock:
+            self._postings.clear()
+            self._books_trigrams.clear()
+            for bid, words in books_keywords.items():
+                self._add(bid, words)
+            self.built = True
+        logger.opt(colors=True).debug(
+            f"search index built: <y>{len(books_keywords)}</y> books, "
+            f"<y>{len(self._postings)}</y> trigrams"
+        )
+
+    def add(self, bid: int, words: list[str]) -> None:
+        """
+        Adds the book to the index or replaces its words.
+        """
+        with self._lock:
+            if not self.built:
+                return
+            self._remove(bid)
+            self._add(bid, words)
+
+    def remove(self, bid: int) -> None:
+        with self._lock:
+            if self.built:
+                self._remove(bid)
+
+    def invalidate(self) -> None:
+        """
+        Drops the index. It will be rebuilt on the next search.
+        """
+        with self._lock:
+            self.built = False
+            self._postings.clear()
+            self._books_trigrams.clear()
+
+    def search(self, query: str, limit: int | None = None) -> list[int]:
+        """
+        A book matches if it contains at least one word of the query
+        (with typos). Books matching more words and with fewer typos
+        rank higher.
+        :returns: Bids of the matched books, the most relevant first.
+        """
+        scores: dict[int, float] = {}
+        with self._lock:
+            for word in set(normalize(query)):
+                trigrams = word_trigrams(word)
+                hits = Counter()
+                for trigram in trigrams:
+                    if bids := self._postings.get(trigram):
+                        hits.update(bids)
+                for bid, count in hits.items():
+                    if (score := count / len(trigrams)) >= self.MIN_WORD_SCORE:
+                        scores[bid] = scores.get(bid, 0) + score
+        return sorted(scores, key=scores.__getitem__, reverse=True)[:limit]
+
+    def _add(self, bid: int, words: list[str]) -> None:
+        trigrams = set()
+        for word in words:
+            trigrams |= word_trigrams(word)
+        self._books_trigrams[bid] = trigrams
+        for trigram in trigrams:
+            self._postings.setdefault(trigram, set()).add(bid)
+
+    def _remove(self, bid: int) -> None:
+        for trigram in self._books_trigrams.pop(bid, ()):
+            bids = self._postings[trigram]
+            bids.discard(bid)
+            if not bids:
+                del self._postings[trigram]
+
+
+search_index = TrigramIndex()
@@ -0,0 +1,95 @@
+"""
+
+Buffer of the playback positions.
+
+The player reports the position every few seconds.
+Positions are kept in memory and written to the database (and `.abp`)
+once per `FLUSH_INTERVAL` seconds, when playback is paused,
+when another book starts playing, before the library is read
+and at exit. So no more than `FLUSH_INTERVAL` seconds of listening
+can be lost if the application crashes.
+
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+
+from loguru import logger
+from models.book import StopFlag
+
+from .core import Database
+
+# Seconds between writes of the buffered positions
+FLUSH_INTERVAL = float(os.environ.get("STOP_FLAG_FLUSH_INTERVAL", 60))
+
+
+class StopFlagsBuffer:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._pending: dict[int, StopFlag] = {}  # {<bid>: <stop flag>}
+        self._lock = threading.RLock()
+        # Held while the taken positions are written, so they are
+        # written in the order of taking
+        self._write_lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        # Counters of the write amplification
+        self.calls = 0  # Positions received from the player
+        self.writes = 0  # Positions written to the database
+
+    def put(self, bid: int, stop_flag: StopFlag, flush: bool = False) -> None:
+        """
+        Buffers the position of the book.
+        Positions of the other books are flushed immediately.
+        """
+        with self._lock:
+            self.calls += 1
+            flush_others = bool(self._pending.keys() - {bid})
+        if flush_others:
+            self.flush()
+        with self._lock:
+            self._pending[bid] = stop_flag
+            flush = flush or self.flush_interval <= 0
+            if not flush and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush:
+            self.flush()
+
+    def discard(self, bid: int) -> None:
+        """
+        Forgets the buffered position of the book.
+        Waits for the writing of the positions if it has already started.
+        Must not be called while the database is opened.
+        """
+        with self._write_lock, self._lock:
+            self._pending.pop(bid, None)
+
+    def flush(self) -> None:
+        """
+        Writes the buffered positions to the database.
+        Must not be called while the database is opened.
+        """
+        # The buffer isn't locked while writing, as the database
+        # can be opened by the thread waiting for the buffer
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            with Database(autocommit=True) as db:
+                for bid, stop_flag in pending.items():
+                    db.patch(bid, stop_flag=stop_flag)
+            self.writes += len(pending)
+        logger.opt(colors=True).trace(
+            f"stop flags flushed: <y>{', '.join(map(str, pending))}</y>. "
+            f"writes/calls: <y>{self.writes}/{self.calls}</y>"
+        )
+
+
+stop_flags = StopFlagsBuffer()
@@ -0,0 +1,276 @@
+"""
+
+Write-behind of the `.abp` files.
+
+`Database.save` and `Database.patch` don't write `.abp` files themselves.
+Writes are queued and done by a background thread `WRITE_DELAY` seconds
+later, repeated writes of the same book in this time are merged into one.
+
+Files are written atomically: the data is written to a temporary file
+which replaces the `.abp`, so a crash can't leave a truncated `.abp`.
+Temporary files have unique names, as `.abp` files are also written
+directly (by the downloader process and by `Book.scan_dir`).
+Temporary files left by a crash are removed by `Book.scan_dir`.
+Temporary files of a batch are synced to the disk together
+before replacing. Whole written files are recorded in the library manifest.
+
+Queued writes are flushed at exit (before the database is closed).
+Writes of a book are discarded before its files are deleted
+and flushed before they are moved.
+
+A write that fails is queued again (merged with the newer writes
+of the book). After `MAX_WRITE_ATTEMPTS` failures the `.abp`
+is written from the database on the next flush.
+
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import typing as ty
+from dataclasses import dataclass
+from itertools import batched
+
+import orjson
+from loguru import logger
+from models.book import dump_storage
+from tools import open_temp_file, remove_temp_file
+
+from .library_manifest import library_manifest
+
+if ty.TYPE_CHECKING:
+    from models.book import Book
+
+# Seconds between the first queued write and writing
+WRITE_DELAY = float(os.environ.get("ABP_WRITE_DELAY", 2))
+# Files synced to the disk together
+FSYNC_BATCH_SIZE = 64
+# Failed writes of the file before it is written from the database
+MAX_WRITE_ATTEMPTS = 3
+
+
+@dataclass(slots=True)
+class PendingWrite:
+    bid: int
+    fields: dict[str, ty.Any]  # Data of the `.abp` or the patched fields
+    full: bool  # True - `fields` is the whole data
+    attempts: int = 0  # Failed writes
+
+
+class StorageWriter:
+    def __init__(self, write_delay: float = WRITE_DELAY):
+        self.write_delay = write_delay
+        # {<.abp file path>: <write>}
+        self._pending: dict[str, PendingWrite] = {}
+        self._cond = threading.Condition()
+        # Held while the taken writes are written
+        self._write_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        # Bids of the books which `.abp` must be written from the database
+        self._regenerate: set[int] = set()
+        # Counters of the write amplification
+        self.calls = 0  # Writes queued
+        self.writes = 0  # Files written
+
+    def save(self, book: Book) -> None:
+        """
+        Queues writing of the whole `.abp`.
+        """
+        data = book.to_dump()
+        # The book can be changed before writing
+        data["files"] = dict(data["files"])
+        self._put(book.abp_file_path, PendingWrite(book.id, data, True))
+
+    def patch(self, book: Book, **fields) -> None:
+        """
+        Queues updating of the given fields in the `.abp`.
+        If the file is missing or corrupted,
+        it is written from the database.
+        """
+        self._put(book.abp_file_path, PendingWrite(book.id, fields, False))
+
+    def _put(self, file_path: str, write: PendingWrite) -> None:
+        with self._cond:
+            self.calls += 1
+            pending = self._pending.get(file_path)
+            if pending is not None and not write.full:
+                pending.fields.update(write.fields)
+            else:
+                self._pending[file_path] = write
+            if self.write_delay > 0:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="storage_writer", daemon=True
+                    )
+                    self._thread.start()
+                self._cond.notify()
+        if self.write_delay <= 0:
+            self.flush()
+
+    def discard(self, book: Book) -> None:
+        """
+        Forgets the queued writes of the book.
+        Waits for the writing of the book if it has already started.
+        """
+        with self._write_lock, self._cond:
+            self._pending.pop(book.abp_file_path, None)
+            self._regenerate.discard(book.id)
+
+    def flush(self) -> None:
+        """
+        Writes the queued files.
+        Failed writes stay queued after `MAX_WRITE_ATTEMPTS` tries.
+        """
+        for __ in range(MAX_WRITE_ATTEMPTS):
+            if not self._pending and not self._regenerate:
+                break
+            self._write_pending()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.write_delay)
+            self._write_pending()
+
+    @logger.catch
+    def _write_pending(self) -> None:
+        with self._cond:
+            regenerate, self._regenerate = self._regenerate, set()
+        if regenerate:
+            self._save_from_database(regenerate)
+        unreadable = []
+        failed = 0
+        with self._write_lock:
+            with self._cond:
+                pending, self._pending = self._pending, {}
+            for batch in batched(pending.items(), FSYNC_BATCH_SIZE):
+                batch_failed, batch_unreadable = self._write(batch)
+                unreadable.extend(batch_unreadable)
+                failed += len(batch_failed)
+                for file_path, write in batch_failed:
+                    self._retry(file_path, write)
+            self.writes += len(pending) - len(unreadable) - failed
+        if pending:
+            logger.opt(colors=True).trace(
+                f"<r>.abp</r> files written: "
+                f"<y>{len(pending) - len(unreadable) - failed}</y>. "
+                f"writes/calls: <y>{self.writes}/{self.calls}</y>"
+            )
+        if unreadable:
+            # Outside the write lock, as the database can be locked
+            # by the thread waiting for this lock
+            self._save_from_database(unreadable)
+
+    def _retry(self, file_path: str, write: PendingWrite) -> None:
+        """
+        Queues the failed write again.
+        The newer writes of the book are applied over it.
+        """
+        write.attempts += 1
+        if write.attempts >= MAX_WRITE_ATTEMPTS:
+            logger.opt(colors=True).error(
+                f"<r>.abp</r> <y>{file_path}</y> isn't written "
+                f"after <y>{write.attempts}</y> attempts, "
+                "it will be written from the database"
+            )
+            with self._cond:
+                self._regenerate.add(write.bid)
+            return
+        with self._cond:
+            pending = self._pending.get(file_path)
+            if pending is None:
+                self._pending[file_path] = write
+            elif not pending.full:
+                write.fields.update(pending.fields)
+                self._pending[file_path] = write
+            # Else the newer write replaces the whole file
+
+    @staticmethod
+    def _write(
+        batch: ty.Iterable[tuple[str, PendingWrite]],
+    ) -> tuple[list[tuple[str, PendingWrite]], list[int]]:
+        """
+        :returns: Failed writes
+            and bids of the books which `.abp` can't be patched.
+        """
+        failed = []
+        unreadable = []
+        files = []
+        try:
+            for file_path, write in batch:
+                try:
+                    if write.full:
+                        data = write.fields
+                    else:
+                        with open(file_path, "rb") as file:
+                            data = orjson.loads(file.read())
+                        data.update(write.fields)
+                except (IOError, orjson.JSONDecodeError) as err:
+                    logger.opt(colors=True).debug(
+                        f"failed to read <r>.abp</r> <y>{file_path}</y>: "
+                        f"<lr>{type(err).__name__}: {err}</lr>"
+                    )
+                    unreadable.append(write.bid)
+                    continue
+                file = None
+                try:
+                    file = open_temp_file(file_path)
+                    file.write(dump_storage(data))
+                except IOError as err:
+                    _log_write_error(file_path, err)
+                    if file is not None:
+                        remove_temp_file(file)
+                    failed.append((file_path, write))
+                    continue
+                files.append((file_path, write, file, data))
+            synced = []
+            for file_path, write, file, data in files:
+                try:
+                    file.flush()
+                    os.fsync(file.fileno())
+                except IOError as err:
+                    _log_write_error(file_path, err)
+                    remove_temp_file(file)
+                    failed.append((file_path, write))
+                    continue
+                synced.append((file_path, write, file, data))
+        finally:
+            for __, __, file, __ in files:
+                file.close()
+
+        written = []
+        for file_path, write, file, data in synced:
+            try:
+                os.replace(file.name, file_path)
+            except IOError as err:
+                _log_write_error(file_path, err)
+                remove_temp_file(file)
+                failed.append((file_path, write))
+                continue
+            if write.full:
+                # Patched fields aren't recorded in the manifest
+                written.append((file_path, data["url"]))
+        library_manifest.put(written)
+        return failed, unreadable
+
+    def _save_from_database(self, bids: ty.Iterable[int]) -> None:
+        from .core import Database
+
+        with Database() as db:
+            for bid in bids:
+                if (book := db.get_book_by_bid(bid)) and book.files:
+                    self.save(book)
+
+
+def _log_write_error(file_path: str, err: IOError) -> None:
+    logger.opt(colors=True).error(
+        f"failed to write <r>.abp</r> <y>{file_path}</y>: "
+        f"<lr>{type(err).__name__}: {err}</lr>"
+    )
+
+
+storage_writer = StorageWriter()
@@ -4,15 +4,10 @@ import subprocess
 import sys
 import time
 
-from .akniga import AKniga
 from .base import BaseDownloadProcessHandler, DownloadProcessStatus, Driver
-from .bookmate import Bookmate
 from .downloader.downloader_client import Client
 from .downloader.downloader_server import run_server
-from .izibuk import Izibuk
-from .knigavuhe import KnigaVUhe
-from .librivox import LibriVox
-from .yakniga import Yakniga
+from .registry import DRIVERS, DriverInfo, get_driver_info
 
 if getattr(sys, "frozen", False):
     FROZEN = True
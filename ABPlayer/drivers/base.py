@@ -17,6 +17,7 @@ from loguru import logger
 from models.book import BookFiles
 from tools import convert_from_bytes, get_file_hash
 
+from .registry import get_suitable_driver_info
 from .tools import (
     IOTasksManager,
     NotImplementedVariable,
@@ -397,7 +398,7 @@ class BaseDownloader(ABC):
 
 
 class Driver(ABC):
-    drivers: list[ty.Type[Driver]] = []  # All available drivers
+    drivers: list[ty.Type[Driver]] = []  # Imported drivers
 
     site_url: str = NotImplementedVariable()  # type: ignore
     downloader_factory: ty.Type[BaseDownloader] = NotImplementedVariable()  # type: ignore
@@ -411,9 +412,11 @@ class Driver(ABC):
 
     @classmethod
     def get_suitable_driver(cls, url: str) -> ty.Type[Driver] | None:
-        for driver in cls.drivers:
-            if url.startswith(driver.site_url):
-                return driver
+        """
+        Imports the module of the suitable driver only if it is found.
+        """
+        if driver_info := get_suitable_driver_info(url):
+            return driver_info.driver
 
     @staticmethod
     def get_page(url: str) -> requests.Response:
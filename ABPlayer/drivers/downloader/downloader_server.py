@@ -97,8 +97,10 @@ async def download(ws: ServerConnection, bid: int) -> None:
         book, ServerDPH(ws, bid)
     )
     if await downloader.download_book():
+        # The downloader process writes only the `files` column,
+        # other columns may be changed by the UI while downloading
         with Database(autocommit=True) as db:
-            db.save(downloader.book)
+            db.update(bid, files=downloader.book.files)
         logger.info(f"downloading finished: {bid}")
     del downloading_tasks[bid]
 
@@ -0,0 +1,70 @@
+"""
+
+Declarative registry of the drivers.
+
+Allows to find a driver by the site url or by the name
+without importing the driver module.
+The module is imported only when the driver class is requested.
+
+"""
+
+from __future__ import annotations
+
+import importlib
+import typing as ty
+from dataclasses import dataclass
+
+if ty.TYPE_CHECKING:
+    from .base import Driver
+
+
+@dataclass(frozen=True)
+class DriverInfo:
+    name: str  # Name of the driver class
+    module: str  # Module where the driver is implemented
+    site_url: str  # Must be the same as `Driver.site_url`
+    licensed: bool = False  # True - driver is a subclass of `LicensedDriver`
+
+    @property
+    def driver(self) -> ty.Type[Driver]:
+        """
+        Imports the driver module if it is not imported yet.
+        :returns: Driver class.
+        """
+        return getattr(importlib.import_module(self.module), self.name)
+
+
+DRIVERS: list[DriverInfo] = [
+    DriverInfo("AKniga", "drivers.akniga", "https://akniga.org"),
+    DriverInfo(
+        "Bookmate", "drivers.bookmate", "https://books.yandex.ru/", True
+    ),
+    DriverInfo("Izibuk", "drivers.izibuk", "https://izib.uk"),
+    DriverInfo("KnigaVUhe", "drivers.knigavuhe", "https://knigavuhe.org"),
+    DriverInfo("LibriVox", "drivers.librivox", "https://archive.org"),
+    DriverInfo("Yakniga", "drivers.yakniga", "https://yakniga.org"),
+]
+
+
+def get_driver_info(driver_name: str) -> DriverInfo | None:
+    """
+    :returns: Driver info by the driver name.
+    """
+    return next((info for info in DRIVERS if info.name == driver_name), None)
+
+
+def get_suitable_driver_info(url: str) -> DriverInfo | None:
+    """
+    :returns: Info of the driver that can handle the url.
+    """
+    return next(
+        (info for info in DRIVERS if url.startswith(info.site_url)), None
+    )
+
+
+__all__ = [
+    "DriverInfo",
+    "DRIVERS",
+    "get_driver_info",
+    "get_suitable_driver_info",
+]
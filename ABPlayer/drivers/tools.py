@@ -8,10 +8,11 @@ import typing as ty
 from contextlib import suppress
 from pathlib import Path
 
-import eyed3
-from bs4 import BeautifulSoup
 from loguru import logger
 
+if ty.TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
 
 class NotImplementedVariable:
     """
@@ -118,6 +119,8 @@ def prepare_file_metadata(
     """
     if not str(file_path).endswith(".mp3"):
         return
+    import eyed3  # imported here to not slow down the downloader startup
+
     file = eyed3.load(file_path)
     file.initTag()
     file.tag.title = title
@@ -260,6 +263,8 @@ def html_to_text(html: str) -> str:
     """
     Fetches all text from HTML.
     """
+    from bs4 import BeautifulSoup
+
     soup = BeautifulSoup(html, "html.parser")
     return soup.get_text()
 
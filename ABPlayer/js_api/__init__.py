@@ -1,8 +1,9 @@
-from . import books, settings, window_controls
+from . import books, debug, settings, window_controls
 from .js_api import JSApi
 
 JSApi.sections.append(books.BooksApi)
 JSApi.sections.append(window_controls.WindowControlsApi)
 JSApi.sections.append(settings.SettingsApi)
+JSApi.sections.append(debug.DebugApi)
 
 __all__ = ["JSApi"]
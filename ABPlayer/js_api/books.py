@@ -1,10 +1,8 @@
 from __future__ import annotations
 
-import difflib
 import os
 import shutil
 import typing as ty
-from contextlib import suppress
 from dataclasses import asdict
 from datetime import datetime
 from functools import partial
@@ -12,17 +10,30 @@ from pathlib import Path
 
 import requests.exceptions
 import temp_file
-from database import Database
-from drivers import BaseDownloadProcessHandler, DownloadProcessStatus, Driver
+from database import (
+    FACETS,
+    LIBRARY_SORTS,
+    RELEVANCE_SORT,
+    Database,
+    library_manifest,
+    stop_flags,
+    storage_writer,
+)
+from drivers import (
+    DRIVERS,
+    BaseDownloadProcessHandler,
+    DownloadProcessStatus,
+    Driver,
+    get_driver_info,
+)
 from drivers import download as download_book
 from drivers import terminate as terminate_downloading
-from drivers.base import DriverNotAuthenticated, LicensedDriver
+from drivers.base import DriverNotAuthenticated
 from loguru import logger
 from models.book import DATETIME_FORMAT, Status, StopFlag
 from tools import (
     convert_from_bytes,
     duration_sec_to_str,
-    duration_str_to_sec,
     make_book_preview,
     pretty_view,
 )
@@ -30,13 +41,14 @@ from tools import (
 from .js_api import ConnectionFailedError, JSApi, JSApiError
 
 if ty.TYPE_CHECKING:
-    from models.book import Book
+    from models.book import Book, BookCard
 
 
 class BooksApi(JSApi):
     SEARCH_LIMIT = 10
     _download_processes: dict[int, DownloadingProcessHandler | None] = {}
-    _download_queue: list[int] = []
+    # Ordered set of the bids waiting for downloading {<bid>: None}
+    _download_queue: dict[int, None] = {}
 
     def __init__(self):
         self.library_search_query: str | None = None
@@ -49,6 +61,7 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>book by bid</r> | <y>{bid}</y>"
         )
+        stop_flags.flush()
         with Database() as db:
             if book := db.get_book_by_bid(bid):
                 logger.opt(colors=True).debug(f"book found: {book:styled}")
@@ -59,7 +72,7 @@ class BooksApi(JSApi):
     def get_library(
         self,
         limit: int,
-        offset: int = 0,
+        cursor: ty.Any = None,
         sort: str | None = None,
         reverse: bool | None = None,
         author: str | None = None,
@@ -67,19 +80,39 @@ class BooksApi(JSApi):
         favorite: bool | None = None,
         status: str | None = None,
         search_query: str | None = None,
+        progress: list[int] | None = None,
     ):
+        """
+        :param cursor: Cursor returned with the previous page.
+            None - the first page.
+        :param progress: [<min>, <max>] listening progress (in percentage).
+        :returns: Books, cursor of the next page
+            and total number of the books (only for the first page).
+        """
         logger.opt(colors=True).debug("request: <r>library</r>")
-        sort = sort if sort else "adding_date"
+        stop_flags.flush()
         reverse = not reverse if reverse is not None else True
-        if (
-            search_query is not None
-            and search_query != self.library_search_query
-        ):
-            self.search_in_library(search_query)
-        if search_query is None and self.library_search_query is not None:
+        bids = None
+        if search_query is None:
             self.library_search_query = None
+        elif search_query != self.library_search_query:
+            self.library_search_query = search_query
             self.matched_books_bids = None
-        bids = self.matched_books_bids
+            with Database() as db:
+                if not (
+                    Database.fts_available
+                    and db.has_search_matches(search_query)
+                ):
+                    # Nothing found by the full-text search
+                    # (or it is not supported), using fuzzy search
+                    self.search_in_library(search_query)
+        if search_query is not None and self.matched_books_bids is not None:
+            bids = self.matched_books_bids
+            search_query = None
+        if search_query is not None and not sort:
+            sort = RELEVANCE_SORT
+        elif sort not in LIBRARY_SORTS:
+            sort = "adding_date"
 
         logger.opt(lazy=True).trace(
             "library filters: {data}",
@@ -87,7 +120,7 @@ class BooksApi(JSApi):
                 pretty_view,
                 dict(
                     limit=limit,
-                    offset=offset,
+                    cursor=cursor,
                     sort=sort,
                     reverse=reverse,
                     author=author,
@@ -95,51 +128,70 @@ class BooksApi(JSApi):
                     favorite=favorite,
                     status=status,
                     bids=bids,
+                    search_query=search_query,
+                    progress=progress,
                 ),
             ),
         )
 
+        filters = dict(
+            author=author,
+            series=series,
+            favorite=favorite,
+            status=status,
+            bids=bids,
+            search_query=search_query,
+            progress=progress,
+        )
+        total = None
         with Database() as db:
-            books = db.get_libray(
-                limit,
-                offset,
-                sort,
-                reverse,
-                author,
-                series,
-                favorite,
-                status,
-                bids,
+            books, next_cursor = db.get_library_page(
+                limit, cursor, sort, reverse, **filters
             )
+            if cursor is None:
+                total = db.count_library(**filters)
 
         logger.opt(colors=True).debug(
             f"<y>{len(books)}</y> books found. "
             f"bids: {pretty_view([book.id for book in books])}"
         )
 
-        return self.make_answer([self._answer_book(book) for book in books])
+        return self.make_answer(
+            dict(
+                books=[self._answer_book(book) for book in books],
+                cursor=next_cursor,
+                total=total,
+            )
+        )
 
     def search_in_library(self, query: str):
         logger.opt(colors=True).debug(
             f"request: <r>search in library</r> | <y>{query}</y>"
         )
-        self.library_search_query = query
         with Database() as db:
-            search_array = db.get_books_keywords()
-            logger.opt(colors=True).trace(f"search array: {search_array}")
-            search_words = query.lower().split()
-            logger.opt(colors=True).trace(f"search words: {search_words}")
-            matched_books_bids = []  # Идентификаторы найденных книг
-            # Поиск
-            for i, array in search_array.items():
-                for search_word in search_words:
-                    if difflib.get_close_matches(search_word, array):
-                        matched_books_bids.append(i)
-                        break
-            logger.opt(colors=True).debug(
-                f"matched books bids: {pretty_view(matched_books_bids)}"
-            )
-            self.matched_books_bids = matched_books_bids
+            self.matched_books_bids = db.fuzzy_search(query)
+        logger.opt(colors=True).debug(
+            f"matched books bids: {pretty_view(self.matched_books_bids)}"
+        )
+
+    def quick_search_in_library(self, query: str, limit: int = SEARCH_LIMIT):
+        """
+        Typo-tolerant search as you type.
+        Not used by the UI yet: the library page searches by `search_query`.
+        :returns: Books of the library, the most relevant first.
+        """
+        logger.opt(colors=True).trace(
+            f"request: <r>quick search in library</r> | <y>{query}</y>"
+        )
+        with Database() as db:
+            if not (bids := db.fuzzy_search(query, limit)):
+                return self.make_answer([])
+            books = {
+                book.id: book for book in db.get_libray(bids=bids, cards=True)
+            }
+        return self.make_answer(
+            [self._answer_book(books[bid]) for bid in bids if bid in books]
+        )
 
     def _book_by_url(self, url: str):
         logger.opt(colors=True).debug(
@@ -185,10 +237,10 @@ class BooksApi(JSApi):
             )
 
         drivers = [
-            driver
-            for driver in Driver.drivers
-            if driver.driver_name in self.search_state
-            and self.search_state[driver.driver_name][1]
+            driver_info.driver
+            for driver_info in DRIVERS
+            if driver_info.name in self.search_state
+            and self.search_state[driver_info.name][1]
         ]
 
         logger.opt(lazy=True).trace(
@@ -295,14 +347,14 @@ class BooksApi(JSApi):
             f"request: <r>toggle favorite</r> | <y>{bid}</y>"
         )
         with Database(autocommit=True) as db:
-            if not (book := db.get_book_by_bid(bid)):
+            if not (fields := db.get_fields(bid, "favorite")):
                 return self.error(BookNotFound(bid=bid))
-            book.favorite = not book.favorite
-            db.save(book)
+            favorite = not fields[0]
+            db.patch(bid, favorite=favorite)
             logger.opt(colors=True).debug(
-                f"{book:styled} favorite: <y>{book.favorite}</y>"
+                f"book <y>{bid}</y> favorite: <y>{favorite}</y>"
             )
-            return self.make_answer(book.favorite)
+            return self.make_answer(favorite)
 
     def mark_as_new(self, bid: int):
         return self._set_book_status(bid, Status.NEW)
@@ -317,34 +369,34 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>set book status</r> | <y>{bid}</y>"
         )
+        stop_flags.flush()
+        fields = dict(status=status)
+        if status == Status.NEW:
+            fields.update(stop_flag=StopFlag())
         with Database(autocommit=True) as db:
-            if not (book := db.get_book_by_bid(bid)):
+            if not db.patch(bid, **fields):
                 return self.error(BookNotFound(bid=bid))
-            book.status = status
-            if status == Status.NEW:
-                book.stop_flag = StopFlag()
-            db.save(book)
-            logger.opt(colors=True).debug(
-                f"{book:styled} status: <y>{book.status.value}</y>"
-            )
-            return self.make_answer()
+        logger.opt(colors=True).debug(
+            f"book <y>{bid}</y> status: <y>{status.value}</y>"
+        )
+        return self.make_answer()
 
-    def set_stop_flag(self, bid: int, item: int, time: int):
+    def set_stop_flag(
+        self, bid: int, item: int, time: int, flush: bool = False
+    ):
+        """
+        The position is buffered, see `database.stop_flags`.
+        :param flush: True - write the position immediately (e.g. on pause).
+        """
         logger.opt(colors=True).trace(
             f"request: <r>set stop flag</r> | <y>{bid}</y>"
         )
-        with Database(autocommit=True) as db:
-            if not (book := db.get_book_by_bid(bid)):
-                return self.error(BookNotFound(bid=bid))
-            book.stop_flag.item = item
-            book.stop_flag.time = time
-            db.save(book)
+        stop_flags.put(bid, StopFlag(item=item, time=time), flush)
 
     def get_all_authors(self):
         logger.opt(colors=True).debug("request: <r>all authors</r>")
         with Database() as db:
             authors = db.get_all_authors()
-        authors.sort()
         logger.opt(colors=True).debug(f"authors found: <y>{len(authors)}</y>")
         return self.make_answer(authors)
 
@@ -352,18 +404,43 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug("request: <r>all series</r>")
         with Database() as db:
             series = db.get_all_series()
-        series.sort()
         logger.opt(colors=True).debug(f"series found: <y>{len(series)}</y>")
         return self.make_answer(series)
 
+    def get_library_facets(self):
+        """
+        :returns: Authors and series of the library with the number of books,
+            the number of downloaded books and total duration.
+        """
+        logger.opt(colors=True).debug("request: <r>library facets</r>")
+        with Database() as db:
+            facets = {facet: db.get_facets(facet) for facet in FACETS}
+        logger.opt(colors=True).debug(
+            "facets found: "
+            + ", ".join(
+                f"{facet}=<y>{len(values)}</y>"
+                for facet, values in facets.items()
+            )
+        )
+        return self.make_answer(
+            {
+                facet: [
+                    dict(
+                        name=name,
+                        books=books,
+                        downloaded=downloaded,
+                        duration=duration_sec_to_str(duration),
+                    )
+                    for name, books, downloaded, duration in values
+                ]
+                for facet, values in facets.items()
+            }
+        )
+
     def get_series_duration(self, series_name: str):
         logger.opt(colors=True).debug("request: <r>all series</r>")
         with Database() as db:
-            durations = db.get_series_durations(series_name)
-        total_duration = 0
-        for duration in durations:
-            with suppress(ValueError):
-                total_duration += duration_str_to_sec(duration)
+            total_duration = db.get_series_duration(series_name)
         return self.make_answer(duration_sec_to_str(total_duration))
 
     def check_is_books_exists(self, urls: list[str]):
@@ -379,12 +456,17 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug("request: <r>available drivers</r>")
         available_drivers = [
             dict(
-                name=driver.driver_name,
-                licensed=issubclass(driver, LicensedDriver),
-                authed=getattr(driver, "is_authed", True),
-                url=driver.site_url,
+                name=driver_info.name,
+                licensed=driver_info.licensed,
+                # only licensed drivers need to be imported to check auth
+                authed=(
+                    driver_info.driver.is_authed
+                    if driver_info.licensed
+                    else True
+                ),
+                url=driver_info.site_url,
             )
-            for driver in Driver.drivers
+            for driver_info in DRIVERS
         ]
         logger.opt(colors=True).debug(
             f"available drivers count: <y>{len(available_drivers)}</y>"
@@ -395,16 +477,10 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>logout driver</r> | <y>{driver_name}</y>"
         )
-        driver = next(
-            (
-                driver
-                for driver in Driver.drivers
-                if driver.driver_name == driver_name
-            ),
-            None,
-        )
-        if not driver or not issubclass(driver, LicensedDriver):
+        driver_info = get_driver_info(driver_name)
+        if not driver_info or not driver_info.licensed:
             return self.error(NoSuitableDriver())
+        driver = driver_info.driver
         driver.logout()
         logger.opt(colors=True).debug(f"Logout from <y>{driver}</y>")
         return self.make_answer()
@@ -413,16 +489,10 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>login driver</r> | <y>{driver_name}</y>"
         )
-        driver = next(
-            (
-                driver
-                for driver in Driver.drivers
-                if driver.driver_name == driver_name
-            ),
-            None,
-        )
-        if not driver or not issubclass(driver, LicensedDriver):
+        driver_info = get_driver_info(driver_name)
+        if not driver_info or not driver_info.licensed:
             return self.error(NoSuitableDriver())
+        driver = driver_info.driver
         if not driver.auth():
             return self.error(NotAuthenticated())
         logger.opt(colors=True).debug(f"Login to <y>{driver}</y>")
@@ -432,22 +502,24 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug("request: <r>get downloads</r>")
         downloads: list[tuple[int, str, str | None, str | None]] = []
         # [(bid, book_name, status, total_size), ...]
+        bids = list(
+            dict.fromkeys([*self._download_processes, *self._download_queue])
+        )
         with Database() as db:
-            for bid in [
-                *self._download_processes.keys(),
-                *self._download_queue,
-            ]:
-                book = db.get_book_by_bid(bid)
-                status = DownloadProcessStatus.WAITING.value
-                total_size = None
-                if dph := self._download_processes.get(bid):
-                    status = dph.status.value
-                    total_size = (
-                        convert_from_bytes(dph.total_size)
-                        if dph.status == DownloadProcessStatus.DOWNLOADING
-                        else str(dph.total_size)
-                    )
-                downloads.append((bid, book.name, status, total_size))
+            names = db.get_books_names(*bids)
+        for bid in bids:
+            if bid not in names:
+                continue
+            status = DownloadProcessStatus.WAITING.value
+            total_size = None
+            if dph := self._download_processes.get(bid):
+                status = dph.status.value
+                total_size = (
+                    convert_from_bytes(dph.total_size)
+                    if dph.status == DownloadProcessStatus.DOWNLOADING
+                    else str(dph.total_size)
+                )
+            downloads.append((bid, names[bid], status, total_size))
 
         logger.opt(colors=True).debug(
             f"<y>{len(downloads)}</y> downloads found."
@@ -476,7 +548,7 @@ class BooksApi(JSApi):
             return self.error(ConnectionFailedError())
 
         if len([1 for x in self._download_processes.values() if x]) >= 5:
-            self._download_queue.append(bid)
+            self._download_queue[bid] = None
             logger.opt(colors=True).debug(
                 f"added to download queue: {book:styled}"
             )
@@ -500,14 +572,16 @@ class BooksApi(JSApi):
             )
 
         if self._download_queue:
-            self.download_book(self._download_queue.pop(0))
+            next_bid = next(iter(self._download_queue))
+            del self._download_queue[next_bid]
+            self.download_book(next_bid)
 
     def terminate_downloading(self, bid: int):
         logger.opt(colors=True).debug(
             f"request: <r>terminate downloading</r> | <y>{bid}</y>"
         )
         if bid in self._download_queue:
-            self._download_queue.remove(bid)
+            del self._download_queue[bid]
             if bid in self._download_processes:
                 self._download_processes.pop(bid)
         elif bid in self._download_processes:
@@ -539,6 +613,7 @@ class BooksApi(JSApi):
         book.multi_readers = False
         old_path = book.dir_path
         Path(new_path).mkdir(parents=True, exist_ok=True)
+        storage_writer.flush()
 
         for file in [*book.files, "cover.jpg", ".abp"]:
             file_path = os.path.join(old_path, file)
@@ -575,6 +650,8 @@ class BooksApi(JSApi):
             return self.error(BookNotDownloaded(bid=bid))
 
         logger.opt(colors=True).debug(f"deleting book: {book:styled}")
+        storage_writer.discard(book)
+        library_manifest.remove(book)
         self._delete_book_files(
             book.dir_path, [*book.files.keys(), "cover.jpg", ".abp"]
         )
@@ -593,6 +670,8 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>remove book</r> | <y>{bid}</y>"
         )
+        # Before opening the database, as the buffer writes to it
+        stop_flags.discard(bid)
         with Database() as db:
             if not (book := db.get_book_by_bid(bid)):
                 return self.error(BookNotFound(bid=bid))
@@ -602,6 +681,8 @@ class BooksApi(JSApi):
                     book.dir_path,
                     [*book.files.keys(), "cover.jpg"],
                 )
+                storage_writer.discard(book)
+                library_manifest.remove(book)
                 os.remove(book.abp_file_path)
             db.remove_book(bid)
             db.commit()
@@ -614,35 +695,35 @@ class BooksApi(JSApi):
         logger.opt(colors=True).debug(
             f"request: <r>fix preview</r> | <y>{bid}</y>"
         )
-        with Database(autocommit=True) as db:
+        with Database() as db:
             if not (book := db.get_book_by_bid(bid)):
                 return
-            if not (driver := Driver.get_suitable_driver(book.url)):
-                return
-            try:
-                new_data = driver().get_book(book.url)
-            except requests.exceptions.ConnectionError as err:
-                return
-            book.preview = new_data.preview
-            logger.opt(colors=True).info(
-                f"new book <y>{bid}</y> preview: {book.preview}"
-            )
-            db.save(book)
+        if not (driver := Driver.get_suitable_driver(book.url)):
+            return
+        try:
+            new_data = driver().get_book(book.url)
+        except requests.exceptions.ConnectionError:
+            return
+        logger.opt(colors=True).info(
+            f"new book <y>{bid}</y> preview: {new_data.preview}"
+        )
+        with Database(autocommit=True) as db:
+            db.patch(bid, preview=new_data.preview)
 
     @staticmethod
     def fix_items(bid: int):
         logger.opt(colors=True).debug(
             f"request: <r>fix items</r> | <y>{bid}</y>"
         )
-        with Database(autocommit=True) as db:
+        with Database() as db:
             if not (book := db.get_book_by_bid(bid)):
                 return
-            if not (driver := Driver.get_suitable_driver(book.url)):
-                return
-            new_data = driver().get_book(book.url)
-            book.items = new_data.items
-            logger.opt(colors=True).info(f"book <y>{bid}</y> items are fixed")
-            db.save(book)
+        if not (driver := Driver.get_suitable_driver(book.url)):
+            return
+        new_data = driver().get_book(book.url)
+        logger.opt(colors=True).info(f"book <y>{bid}</y> items are fixed")
+        with Database(autocommit=True) as db:
+            db.patch(bid, items=new_data.items)
 
     def open_book_dir(self, bid: int):
         logger.opt(colors=True).debug(
@@ -656,7 +737,9 @@ class BooksApi(JSApi):
         os.startfile(book.dir_path)
         return self.make_answer()
 
-    def _answer_book(self, book: Book, listening_data: bool = False) -> dict:
+    def _answer_book(
+        self, book: Book | BookCard, listening_data: bool = False
+    ) -> dict:
         data: dict[str, ty.Any] = dict(
             bid=book.id,
             author=book.author,
@@ -676,7 +759,7 @@ class BooksApi(JSApi):
             listening_progress=book.listening_progress,
             favorite=book.favorite,
             adding_date=book.adding_date.strftime(DATETIME_FORMAT),
-            downloaded=bool(len(book.files)),
+            downloaded=book.downloaded,
             downloading=(
                 book.id in self._download_queue
                 or book.id in self._download_processes
@@ -689,6 +772,9 @@ class BooksApi(JSApi):
                 dict(
                     stop_flag=asdict(book.stop_flag),
                     items=book.items.to_dump(),
+                    # Starts of the chapters from the start of the book
+                    # and the end of the book
+                    offsets=book.items.offsets.offsets,
                     files=[
                         os.path.join(book_path, file_name)
                         for file_name in book.files
@@ -713,7 +799,10 @@ class DownloadingProcessHandler(BaseDownloadProcessHandler):
             if status == DownloadProcessStatus.DOWNLOADING
             else total_size
         )
-        self.js_api.evaluate_js(f"initTotalSize({self.bid}, '{total_size}')")
+        self.js_api.post_js(
+            ("total_size", self.bid),
+            f"initTotalSize({self.bid}, '{total_size}')",
+        )
 
     def show_progress(self) -> None:
         done_size = (
@@ -721,11 +810,11 @@ class DownloadingProcessHandler(BaseDownloadProcessHandler):
             if self.status == DownloadProcessStatus.DOWNLOADING
             else self.done_size
         )
-        with suppress(Exception):
-            self.js_api.evaluate_js(
-                f"downloadingCallback({self.bid}, "
-                f"{round(self.done_size / (self.total_size / 100), 2)}, '{done_size}')"
-            )
+        self.js_api.post_js(
+            ("downloading_progress", self.bid),
+            f"downloadingCallback({self.bid}, "
+            f"{round(self.done_size / (self.total_size / 100), 2)}, '{done_size}')",
+        )
 
     @property
     def status(self) -> DownloadProcessStatus:
@@ -737,10 +826,10 @@ class DownloadingProcessHandler(BaseDownloadProcessHandler):
             self.done_size = self.total_size
             self.show_progress()
         self._status = v
-        with suppress(Exception):
-            self.js_api.evaluate_js(
-                f"setDownloadingStatus({self.bid}, '{v.value}')"
-            )
+        self.js_api.post_js(
+            ("downloading_status", self.bid),
+            f"setDownloadingStatus({self.bid}, '{v.value}')",
+        )
         if v in {
             DownloadProcessStatus.FINISHED,
             DownloadProcessStatus.TERMINATED,
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from database import Database, library_model
+from database.profiling import query_profiler
+from loguru import logger
+
+from .js_api import JSApi, JSApiError
+
+
+class DebugApi(JSApi):
+    def get_query_stats(self):
+        """
+        :returns: Stats of the database queries (see `database.profiling`).
+        """
+        logger.opt(colors=True).debug("request: <r>get query stats</r>")
+        if not query_profiler.enabled:
+            return self.error(QueriesProfilingDisabled())
+        return self.make_answer(query_profiler.stats())
+
+    def reset_query_stats(self):
+        logger.opt(colors=True).debug("request: <r>reset query stats</r>")
+        query_profiler.reset()
+        return self.make_answer()
+
+    def check_library_model(self):
+        """
+        Compares the in-memory library model with the database.
+        :returns: Bids of the books which cards differ.
+        """
+        logger.opt(colors=True).debug("request: <r>check library model</r>")
+        with Database() as db:
+            return self.make_answer(library_model.check(db))
+
+
+class QueriesProfilingDisabled(JSApiError):
+    code = 11
+    # Debug only, not translated
+    message = "queries profiling is disabled (PROFILE_QUERIES)"
@@ -9,6 +9,8 @@ import webview
 from loguru import logger
 from tools import pretty_view
 
+from .js_bus import js_bus
+
 
 class JSApi:
     sections: list[ty.Type[JSApi]] = []
@@ -32,7 +34,21 @@ class JSApi:
         return webview.windows[0]
 
     def evaluate_js(self, command: str) -> ty.Any:
-        return self._window.evaluate_js(command)
+        return js_bus.evaluate(command)
+
+    def evaluate_js_values(self, **expressions: str) -> dict[str, ty.Any]:
+        """
+        Evaluates several expressions by one round trip.
+        :returns: {<name>: <value of the expression>}
+        """
+        return js_bus.evaluate_values(**expressions)
+
+    @staticmethod
+    def post_js(topic: ty.Hashable, command: str) -> None:
+        """
+        Queues the command. Only the latest command of the topic is evaluated.
+        """
+        js_bus.post(topic, command)
 
     @staticmethod
     def make_answer(data: ty.Any = ()) -> dict:
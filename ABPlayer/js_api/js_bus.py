@@ -0,0 +1,125 @@
+"""
+
+Message bus from Python to JS.
+
+Each `evaluate_js` is a blocking round trip into the webview.
+Frequent updates of the UI (progress of downloading) are posted
+to the bus by topic instead: only the latest message of the topic
+is kept and the queued messages are evaluated together
+by one `evaluate_js` every `FLUSH_INTERVAL` seconds.
+
+Queued messages are evaluated before any command evaluated through
+the bus, so the order of the updates is kept.
+
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+import typing as ty
+
+import orjson
+import webview
+from loguru import logger
+
+# Seconds between the first queued message and evaluating
+FLUSH_INTERVAL = float(os.environ.get("ABP_JS_FLUSH_INTERVAL", 1 / 30))
+
+
+class JSMessageBus:
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        # {<topic>: <JS command>}
+        self._pending: dict[ty.Hashable, str] = {}
+        self._cond = threading.Condition()
+        # Held while the commands are evaluated
+        self._evaluate_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        # Counters of the round trips
+        self.calls = 0  # Messages posted
+        self.evaluations = 0  # `evaluate_js` calls
+
+    @property
+    def _window(self) -> webview.Window:
+        return webview.windows[0]
+
+    def post(self, topic: ty.Hashable, command: str) -> None:
+        """
+        Queues the command. The queued command of the topic is replaced.
+        """
+        with self._cond:
+            self.calls += 1
+            # The latest message is evaluated after the other ones
+            self._pending.pop(topic, None)
+            self._pending[topic] = command
+            if self.flush_interval > 0:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="js_bus", daemon=True
+                    )
+                    self._thread.start()
+                self._cond.notify()
+        if self.flush_interval <= 0:
+            self.flush()
+
+    def evaluate(self, command: str) -> ty.Any:
+        """
+        Evaluates the command after the queued messages.
+        :returns: Result of the command.
+        """
+        with self._evaluate_lock:
+            script = self._take_script()
+            self.evaluations += 1
+            return self._window.evaluate_js(script + command)
+
+    def evaluate_values(self, **expressions: str) -> dict[str, ty.Any]:
+        """
+        Evaluates several expressions by one `evaluate_js`.
+        :returns: {<name>: <value of the expression>}
+        """
+        return self.evaluate(
+            "({%s})"
+            % ",".join(
+                f"{orjson.dumps(name).decode()}: ({expression})"
+                for name, expression in expressions.items()
+            )
+        )
+
+    def flush(self) -> None:
+        """
+        Evaluates the queued messages.
+        """
+        with self._evaluate_lock:
+            if not (script := self._take_script()):
+                return
+            self.evaluations += 1
+            try:
+                self._window.evaluate_js(script)
+            except Exception as err:
+                # The window can be closed
+                logger.opt(colors=True).debug(
+                    f"failed to evaluate queued JS messages: "
+                    f"<lr>{type(err).__name__}: {err}</lr>"
+                )
+
+    def _take_script(self) -> str:
+        with self._cond:
+            pending, self._pending = self._pending, {}
+        # The failed message doesn't break the following ones
+        return "".join(
+            f"try{{{command}}}catch(e){{console.error(e)}};"
+            for command in pending.values()
+        )
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+js_bus = JSMessageBus()
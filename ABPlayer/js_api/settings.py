@@ -5,6 +5,7 @@ import shutil
 import sys
 import time
 import typing as ty
+from itertools import batched
 from pathlib import Path
 from subprocess import Popen
 
@@ -13,7 +14,13 @@ import locales
 import requests
 import temp_file
 import webview
-from database import Database
+from database import (
+    IMPORT_BATCH_SIZE,
+    Database,
+    library_manifest,
+    load_books,
+    storage_writer,
+)
 from loguru import logger
 from models.book import Book
 from orjson import orjson
@@ -80,35 +87,30 @@ class SettingsApi(JSApi):
             logger.debug("selected same dir")
             return self.error(RequestCanceled())
 
+        # Queued files are written to the old library
+        storage_writer.flush()
         config.update_config(books_folder=new_dir)
         logger.opt(colors=True).info(
             f"books folder changed: <e>{old_dir}</e> <g>-></g> <y>{new_dir}</y>"
         )
 
-        books = list(Book.scan_dir(new_dir))
+        storage_books, from_manifest = library_manifest.load_library(new_dir)
         with Database() as db:
             db.clear_files()
             logger.debug("files data cleared from database")
             is_old_library_empty = db.is_library_empty()
 
-            exists_books_urls = db.check_is_books_exists(
-                [book.url for book in books]
-            )
             new_books_count = 0
-            for book in books:
-                if book.url in exists_books_urls:
-                    db_book = db.get_book_by_url(book.url)
-                    db_book.files = book.files
-                    db.save(db_book)
-                    continue
-                new_books_count += 1
-                db.add_book(book)
+            for batch in batched(load_books(storage_books), IMPORT_BATCH_SIZE):
+                new_books_count += db.import_books(batch, update_files=True)
 
             db.commit()
 
             logger.opt(colors=True).debug(
                 f"<y>{new_books_count}</y> new books added to library"
             )
+        if from_manifest:
+            library_manifest.verify_in_background(new_dir)
 
         return self.make_answer(
             dict(
@@ -122,16 +124,22 @@ class SettingsApi(JSApi):
         if self.old_books_folder is None:
             return self.error(RequestCanceled())
 
-        moved_books_count = 0
+        books = []
+        for book in Book.scan_dir(self.old_books_folder):
+            if os.path.exists(book.dir_path):
+                logger.opt(colors=True).debug(f"{book:styled} already exists")
+                continue
+            books.append(book)
+
+        moved_books = []
         with Database() as db:
-            for book in Book.scan_dir(self.old_books_folder):
-                if os.path.exists(book.dir_path):
-                    logger.opt(colors=True).debug(
-                        f"{book:styled} already exists"
-                    )
-                    continue
-                db_book = db.get_book_by_url(book.url)
-                if not db_book:
+            exists_books_urls = set()
+            for batch in batched(books, IMPORT_BATCH_SIZE):
+                exists_books_urls.update(
+                    db.check_is_books_exists([book.url for book in batch])
+                )
+            for book in books:
+                if book.url not in exists_books_urls:
                     logger.opt(colors=True).debug(
                         f"{book:styled} not found in library"
                     )
@@ -165,14 +173,17 @@ class SettingsApi(JSApi):
                 except IOError:
                     pass
 
-                db_book.files = book.files
-                db.save(db_book)
-
-                moved_books_count += 1
+                moved_books.append(book)
                 logger.opt(colors=True).debug(f"{book:styled} moved")
 
-            if moved_books_count:
+            if moved_books:
+                library_manifest.put(
+                    (book.abp_file_path, book.url) for book in moved_books
+                )
+                for batch in batched(moved_books, IMPORT_BATCH_SIZE):
+                    db.import_books(batch, update_files=True)
                 db.commit()
+        moved_books_count = len(moved_books)
 
         logger.opt(colors=True).debug(
             f"books moved: <y>{moved_books_count}</y>"
@@ -393,8 +404,9 @@ class SettingsApi(JSApi):
             for chunk in response.iter_content(chunk_size=1024):
                 offset += len(chunk)
                 file.write(chunk)
-                self.evaluate_js(
-                    f"updaterDownloading({offset / (total_size / 100)})"
+                self.post_js(
+                    "updater_progress",
+                    f"updaterDownloading({offset / (total_size / 100)})",
                 )
             return True
         except IOError as err:
@@ -5,10 +5,12 @@ import typing as ty
 from ctypes import Structure, byref, c_long, windll
 
 import temp_file
+from database import stop_flags, storage_writer
 from loguru import logger
 from tools import ttl_cache
 
 from .js_api import JSApi
+from .js_bus import js_bus
 
 if ty.TYPE_CHECKING:
     import webview
@@ -46,14 +48,23 @@ class WindowControlsApi(JSApi):
         scale_k = query_scale_k()
         width = int(self._window.width / scale_k)
         height = int(self._window.height / scale_k)
-        is_main_menu_opened = self._window.evaluate_js("menu_opened")
-        is_filter_menu_opened = self._window.evaluate_js("filter_menu_opened")
-        required_drivers = self._window.evaluate_js("required_drivers")
-        volume = self._window.evaluate_js("player.volume") * 100
-        speed = self._window.evaluate_js("player.speed")
-        last_listened_book_bid = self._window.evaluate_js(
-            "(player.current_book)?player.current_book.bid:null"
+        # One round trip instead of one for each value
+        values = self.evaluate_js_values(
+            is_main_menu_opened="menu_opened",
+            is_filter_menu_opened="filter_menu_opened",
+            required_drivers="required_drivers",
+            volume="player.volume * 100",
+            speed="player.speed",
+            last_listened_book_bid=(
+                "(player.current_book)?player.current_book.bid:null"
+            ),
         )
+        is_main_menu_opened = values["is_main_menu_opened"]
+        is_filter_menu_opened = values["is_filter_menu_opened"]
+        required_drivers = values["required_drivers"]
+        volume = values["volume"]
+        speed = values["speed"]
+        last_listened_book_bid = values["last_listened_book_bid"]
         temp_file.update(
             width=width,
             height=height,
@@ -74,6 +85,20 @@ class WindowControlsApi(JSApi):
         )
         if last_listened_book_bid is None:
             temp_file.delete_items("last_listened_book_bid")
+        stop_flags.flush()
+        logger.opt(colors=True).debug(
+            "stop flags writes/calls: "
+            f"<y>{stop_flags.writes}/{stop_flags.calls}</y>"
+        )
+        storage_writer.flush()
+        logger.opt(colors=True).debug(
+            "<r>.abp</r> writes/calls: "
+            f"<y>{storage_writer.writes}/{storage_writer.calls}</y>"
+        )
+        logger.opt(colors=True).debug(
+            "JS evaluations/messages: "
+            f"<y>{js_bus.evaluations}/{js_bus.calls}</y>"
+        )
         logger.trace("session data saved")
 
 
@@ -1,7 +1,7 @@
 import os
 import platform
 
-from tools import pretty_view
+from startup_profiler import HEAVY_MODULES, profiler
 
 # CONFIG SETUP
 # Path to the application directory
@@ -37,8 +37,14 @@ from logger import logger  # noqa
 
 
 def main() -> None:
+    if os.environ.get("PROFILE_STARTUP"):
+        profiler.measure_imports(*HEAVY_MODULES)
+    else:
+        profiler.record_imports(*HEAVY_MODULES)
+
     import webview
     from starting_window import create_starting_window
+    from tools import pretty_view
 
     logger.opt(colors=True).debug(
         "starting params: "
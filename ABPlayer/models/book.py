@@ -3,10 +3,16 @@ from __future__ import annotations
 import os
 import re
 import typing as ty
+from abc import ABCMeta
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableSequence
 from dataclasses import asdict, dataclass, field
 from datetime import datetime
 from enum import Enum
-from functools import partial
+from functools import wraps
+from itertools import accumulate
+from operator import sub
 from pathlib import Path
 
 import orjson
@@ -15,13 +21,19 @@ from tools import (
     duration_sec_to_str,
     get_audio_file_duration,
     get_file_hash,
-    pretty_view,
+    remove_temp_files,
+    write_file_atomic,
 )
 
 DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# True - chapters loaded from the database and `.abp`
+# are stored in parallel arrays (see `ColumnarBookItems`)
+COLUMNAR_BOOK_ITEMS = bool(os.environ.get("COLUMNAR_BOOK_ITEMS"))
+# `.abp` files loaded concurrently by `Book.scan_dir`
+SCAN_BATCH_SIZE = 256
 
 
-@dataclass
+@dataclass(slots=True)
 class BookItem:
     """
     Chapter of the book.
@@ -41,22 +53,259 @@ class BookItem:
         return self.end_time - self.start_time
 
 
-class BookItems(list[BookItem]):
+class ChapterOffsets:
+    """
+    Offsets of the chapters from the start of the book (prefix sums
+    of the durations). Maps the time from the start of the book
+    to the position in the chapter and back in O(log n).
+    """
+
+    __slots__ = ("offsets",)
+
+    def __init__(self, durations: ty.Iterable[int | float]):
+        # offsets[i] - start of the chapter `i`, offsets[-1] - end of the book
+        self.offsets: list[int | float] = [0, *accumulate(durations)]
+
+    @property
+    def total(self) -> int | float:
+        """
+        Duration of the book (in seconds).
+        """
+        return self.offsets[-1]
+
+    def global_time(self, item: int, time: int | float = 0) -> int | float:
+        """
+        :returns: Time from the start of the book
+            of the position `time` in the chapter `item`.
+        """
+        return self.offsets[min(max(item, 0), len(self.offsets) - 1)] + time
+
+    def position(self, global_time: int | float) -> tuple[int, int | float]:
+        """
+        :returns: Chapter (index) and the time in it
+            of the time from the start of the book.
+        """
+        item = min(
+            max(bisect_right(self.offsets, global_time) - 1, 0),
+            max(len(self.offsets) - 2, 0),
+        )
+        return item, global_time - self.offsets[item]
+
+    def remaining(self, item: int, time: int | float = 0) -> int | float:
+        """
+        :returns: Time to the end of the book from the position.
+        """
+        return max(self.total - self.global_time(item, time), 0)
+
+
+def _invalidates_offsets(method: ty.Callable) -> ty.Callable:
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._offsets = None
+        return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class BookItems(list[BookItem], metaclass=ABCMeta):
     """
     List of chapters.
     Represented as a list of dictionaries.
+    Offsets of the chapters are cached until the list is changed,
+    so a changed chapter has to be assigned back.
     """
 
+    __slots__ = ("_offsets",)
+
     def __init__(self, items: list[BookItem | dict[str, str | int]] = ()):
         super().__init__(
             BookItem(**item) if isinstance(item, dict) else item
             for item in items
         )
+        self._offsets: ChapterOffsets | None = None
+
+    @property
+    def offsets(self) -> ChapterOffsets:
+        if getattr(self, "_offsets", None) is None:
+            self._offsets = ChapterOffsets(item.duration for item in self)
+        return self._offsets
+
+    @classmethod
+    def from_dump(
+        cls, items: list[dict[str, str | int]]
+    ) -> BookItems | ColumnarBookItems:
+        """
+        :returns: Chapters in the representation
+            chosen by `COLUMNAR_BOOK_ITEMS`.
+        """
+        if COLUMNAR_BOOK_ITEMS:
+            return ColumnarBookItems(items)
+        return cls(items)
 
     def to_dump(self) -> list[dict]:
         return [asdict(item) for item in self]
 
 
+class ColumnarBookItems(MutableSequence[BookItem]):
+    """
+    List of chapters stored in parallel arrays.
+    Takes several times less memory than `BookItems`
+    for books with hundreds of chapters.
+    Chapters are created on access, so changing a chapter
+    doesn't change the list, a changed chapter has to be assigned back.
+    Times are stored as floats, integral values are returned as int.
+    """
+
+    __slots__ = (
+        "file_urls",
+        "file_indexes",
+        "titles",
+        "start_times",
+        "end_times",
+        "_offsets",
+    )
+
+    def __init__(
+        self, items: ty.Iterable[BookItem | dict[str, str | int]] = ()
+    ):
+        self.file_urls: list[str] = []
+        self.file_indexes = array("q")
+        self.titles: list[str] = []
+        self.start_times = array("d")
+        self.end_times = array("d")
+        self._offsets: ChapterOffsets | None = None
+        for item in items:
+            self.insert(len(self.titles), item)
+
+    @property
+    def offsets(self) -> ChapterOffsets:
+        if self._offsets is None:
+            self._offsets = ChapterOffsets(
+                map(_time, map(sub, self.end_times, self.start_times))
+            )
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __getitem__(self, index: int | slice) -> BookItem | ColumnarBookItems:
+        if isinstance(index, slice):
+            return ColumnarBookItems(
+                self[i] for i in range(*index.indices(len(self)))
+            )
+        return BookItem(
+            self.file_urls[index],
+            self.file_indexes[index],
+            self.titles[index],
+            _time(self.start_times[index]),
+            _time(self.end_times[index]),
+        )
+
+    def __setitem__(
+        self,
+        index: int | slice,
+        item: BookItem | dict | ty.Iterable[BookItem | dict],
+    ) -> None:
+        if isinstance(index, slice):
+            items = list(self)
+            items[index] = item
+            self._columns_clear()
+            for item in items:
+                self.insert(len(self.titles), item)
+            return
+        del self[index]
+        self.insert(index if index >= 0 else len(self) + index + 1, item)
+
+    def __delitem__(self, index: int | slice) -> None:
+        self._offsets = None
+        for column in self._columns():
+            del column[index]
+
+    def __iter__(self) -> ty.Iterator[BookItem]:
+        for file_url, file_index, title, start_time, end_time in zip(
+            *self._columns()
+        ):
+            yield BookItem(
+                file_url, file_index, title, _time(start_time), _time(end_time)
+            )
+
+    def __eq__(self, other: ty.Any) -> bool:
+        if isinstance(other, (list, ColumnarBookItems)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ColumnarBookItems({list(self)!r})"
+
+    def insert(
+        self, index: int, item: BookItem | dict[str, str | int]
+    ) -> None:
+        if isinstance(item, dict):
+            item = BookItem(**item)
+        self._offsets = None
+        file_url = item.file_url
+        if index and self.file_urls[index - 1] == file_url:
+            # Chapters of one file share the url
+            file_url = self.file_urls[index - 1]
+        self.file_urls.insert(index, file_url)
+        self.file_indexes.insert(index, item.file_index)
+        self.titles.insert(index, item.title)
+        self.start_times.insert(index, item.start_time)
+        self.end_times.insert(index, item.end_time)
+
+    def to_dump(self) -> list[dict]:
+        return [
+            dict(
+                file_url=file_url,
+                file_index=file_index,
+                title=title,
+                start_time=_time(start_time),
+                end_time=_time(end_time),
+            )
+            for file_url, file_index, title, start_time, end_time in zip(
+                *self._columns()
+            )
+        ]
+
+    def _columns(self) -> tuple[MutableSequence, ...]:
+        return (
+            self.file_urls,
+            self.file_indexes,
+            self.titles,
+            self.start_times,
+            self.end_times,
+        )
+
+    def _columns_clear(self) -> None:
+        self._offsets = None
+        for column in self._columns():
+            del column[:]
+
+
+BookItems.register(ColumnarBookItems)
+# Methods changing the list reset the cached offsets
+for _method in (
+    "__setitem__",
+    "__delitem__",
+    "__iadd__",
+    "__imul__",
+    "append",
+    "extend",
+    "insert",
+    "pop",
+    "remove",
+    "clear",
+    "sort",
+    "reverse",
+):
+    setattr(BookItems, _method, _invalidates_offsets(getattr(list, _method)))
+del _method
+
+
+def _time(value: float) -> int | float:
+    return int(value) if value.is_integer() else value
+
+
 class Status(Enum):
     """
     Book status.
@@ -67,7 +316,7 @@ class Status(Enum):
     FINISHED = "finished"  # Finished listening
 
 
-@dataclass
+@dataclass(slots=True)
 class StopFlag:
     """
     The mark where the user stopped listening.
@@ -84,8 +333,35 @@ class BookFiles(dict):
     """
 
 
-@dataclass
-class Book:
+class BookPath:
+    """
+    Mixin building the path to the book in the library.
+    """
+
+    __slots__ = ()
+
+    @property
+    def book_path(self) -> str:
+        """
+        :returns: Relative path to the book in the library.
+        """
+        path = path = os.path.join("./", self.author)
+        if self.series_name:
+            book_name = (
+                (f"{str(self.number_in_series).rjust(2, '0')}. {self.name}")
+                if self.number_in_series
+                else self.name
+            )
+            path = os.path.join(path, self.series_name, book_name)
+        else:
+            path = os.path.join(path, self.name)
+        if self.multi_readers:
+            path = os.path.join(path, self.reader)
+        return path
+
+
+@dataclass(slots=True)
+class Book(BookPath):
     """
     Class describing how books are stored in the database,
     as well as what data drivers parse from websites.
@@ -110,25 +386,6 @@ class Book:
     adding_date: datetime = field(default=datetime(2007, 5, 23))
     multi_readers: bool = False
 
-    @property
-    def book_path(self) -> str:
-        """
-        :returns: Relative path to the book in the library.
-        """
-        path = path = os.path.join("./", self.author)
-        if self.series_name:
-            book_name = (
-                (f"{str(self.number_in_series).rjust(2, '0')}. {self.name}")
-                if self.number_in_series
-                else self.name
-            )
-            path = os.path.join(path, self.series_name, book_name)
-        else:
-            path = os.path.join(path, self.name)
-        if self.multi_readers:
-            path = os.path.join(path, self.reader)
-        return path
-
     @property
     def dir_path(self) -> str:
         """
@@ -145,6 +402,10 @@ class Book:
         """
         return os.path.join(self.dir_path, "cover.jpg")
 
+    @property
+    def downloaded(self) -> bool:
+        return bool(self.files)
+
     @property
     def listening_progress(self) -> str:
         """
@@ -152,35 +413,36 @@ class Book:
         """
         if self.status == Status.FINISHED:
             return "100%"
-        total = sum([item.duration for item in self.items])
-        if not total:
+        offsets = self.items.offsets
+        if not offsets.total:
             return "0%"
-        cur = (
-            sum(
-                [
-                    item.duration
-                    for i, item in enumerate(self.items)
-                    if i < self.stop_flag.item
-                ]
-            )
-            + self.stop_flag.time
-        )
-        return f"{int(round(cur / (total / 100)))}%"
+        cur = offsets.global_time(self.stop_flag.item, self.stop_flag.time)
+        # Rounded half up, same as `progress_pct` in the database
+        return f"{int(cur * 100 / offsets.total + 0.5)}%"
 
     @classmethod
-    def scan_dir(cls, dir_path: str) -> ty.Generator[Book, ty.Any, None]:
+    def scan_dir(
+        cls, dir_path: str, skip: ty.Callable[[str], bool] | None = None
+    ) -> ty.Generator[Book, ty.Any, None]:
         """
         Scans the directory for `.abp` files.
+        Temporary files of the `.abp` left by the previous runs are removed.
+        :param skip: Returns True for the `.abp` files
+            that don't have to be loaded (e.g. not changed).
         :returns: Generator of book instances loaded from found files.
         """
         logger.opt(colors=True).debug(
             f"scanning <y>{dir_path}</y> for <r>.abp</r>"
         )
+        from .codec import storage_decoder
+
         books_found = 0
-        for root, __, file_names in os.walk(dir_path):
-            if ".abp" in file_names:
-                abp_path = os.path.join(root, ".abp")
-                if not (book := Book.load_from_storage(abp_path)):
+        abp_paths: list[str] = []
+
+        def _load_books() -> ty.Generator[Book, ty.Any, None]:
+            nonlocal books_found
+            for abp_path, book in storage_decoder.load_many(abp_paths):
+                if not book:
                     # Remove the file if the book cannot be loaded
                     try:
                         os.remove(abp_path)
@@ -189,6 +451,18 @@ class Book:
                     continue
                 books_found += 1
                 yield book
+            abp_paths.clear()
+
+        for root, __, file_names in os.walk(dir_path):
+            remove_temp_files(root, file_names, ".abp")
+            if ".abp" in file_names:
+                abp_path = os.path.join(root, ".abp")
+                if skip is not None and skip(abp_path):
+                    continue
+                # Files are loaded by batches
+                abp_paths.append(abp_path)
+                if len(abp_paths) == SCAN_BATCH_SIZE:
+                    yield from _load_books()
             elif any(file_name.endswith(".mp3") for file_name in file_names):
                 id_parts = (
                     book_dir := root.removeprefix(f"{dir_path}\\")
@@ -260,6 +534,8 @@ class Book:
                 books_found += 1
                 yield book
 
+        yield from _load_books()
+
         logger.opt(colors=True).debug(f"books found: <y>{books_found}</y>")
 
     @classmethod
@@ -268,68 +544,9 @@ class Book:
         Creates a book instance from a `.abp` file.
         :returns: Book instance or None.
         """
-        logger.opt(colors=True).trace(
-            f"loading data from <r>.abp</r> <y>{file_path}</y>"
-        )
-        try:
-            with open(file_path, "rb") as file:
-                data = dict(**orjson.loads(file.read()))
-            data["items"] = BookItems(data["items"])
-            data["status"] = Status(data["status"])
-            data["stop_flag"] = StopFlag(**data["stop_flag"])
-            data["files"] = BookFiles(data["files"])
-            data["adding_date"] = datetime.strptime(
-                data["adding_date"], DATETIME_FORMAT
-            )
-        except (ValueError, TypeError) as err:
-            logger.opt(colors=True).debug(
-                f"error while loading book from <r>.abp</r> <y>{file_path}</y> : "
-                f"<lr>{type(err).__name__}: {err}</lr>"
-            )
-            return
-
-        if "multi_readers" not in data:
-            data["multi_readers"] = False
-
-        signature = ty.get_type_hints(cls)
-        del signature["id"]
-        try:
-            if len(signature) != len(data):
-                raise ValueError("wrong fields count")
-            for fiend_name, field_type in signature.items():
-                if (value := data.get(fiend_name)) is None:
-                    raise ValueError(f"field `{fiend_name}` not found")
-                elif (value_type := type(value)) is not field_type:
-                    raise ValueError(
-                        f"field value of `{fiend_name}` has `{value_type}` type, "
-                        f"but expected `{field_type}`"
-                    )
-        except ValueError as err:
-            logger.opt(colors=True).debug(
-                f"incorrect data in <r>.abp</r> <y>{file_path}</y>: {err}"
-            )
-            return
-
-        book = Book(**data)
-        if not str(Path(file_path).parent).endswith(
-            book_path := book.book_path[2:]
-        ):
-            logger.opt(colors=True).debug(
-                f"incorrect <r>.abp</r> file path <y>{file_path}</y> "
-                f"it's not ends on <y>{book_path}</y>"
-            )
-            return
+        from .codec import storage_decoder
 
-        logger.opt(lazy=True).trace(
-            "book loaded: {data}",
-            data=partial(
-                pretty_view,
-                book.to_dump(),
-                multiline=not os.getenv("NO_MULTILINE", False),
-            ),
-        )
-
-        return book
+        return storage_decoder.load(file_path)
 
     def save_to_storage(self) -> None:
         """
@@ -338,8 +555,7 @@ class Book:
         logger.opt(colors=True).debug(
             f"{self:styled} saved to <r>.abp</r>: <y>{self.abp_file_path}</y>"
         )
-        with open(self.abp_file_path, "wb") as file:
-            file.write(orjson.dumps(self.to_dump()))
+        write_file_atomic(self.abp_file_path, dump_storage(self.to_dump()))
 
     def to_dump(self) -> dict:
         return dict(
@@ -380,12 +596,67 @@ class Book:
         return repr(self)
 
 
+@dataclass(slots=True)
+class BookCard(BookPath):
+    """
+    Book data displayed in the library list.
+    Chapters and files are not loaded,
+    the progress is calculated by the database.
+    """
+
+    id: int
+    author: str
+    name: str
+    series_name: str
+    number_in_series: str
+    description: str
+    reader: str
+    duration: str
+    url: str
+    preview: str
+    driver: str
+    status: Status
+    favorite: bool
+    adding_date: datetime
+    multi_readers: bool
+    progress: int  # Listening progress in percentage
+    downloaded: bool
+
+    @property
+    def listening_progress(self) -> str:
+        return f"{self.progress}%"
+
+
+def dump_storage(data: dict[str, ty.Any]) -> bytes:
+    """
+    :returns: Content of the `.abp` file with the data.
+    """
+    return orjson.dumps(
+        data, default=_dump_value, option=orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+
+def _dump_value(value: ty.Any) -> ty.Any:
+    """
+    Converts values that orjson can't serialize as `.abp` requires.
+    """
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    elif isinstance(value, ColumnarBookItems):
+        return value.to_dump()
+    raise TypeError
+
+
 __all__ = [
     "BookItem",
     "BookItems",
+    "ChapterOffsets",
+    "ColumnarBookItems",
     "Status",
     "StopFlag",
     "BookFiles",
     "Book",
+    "BookCard",
     "DATETIME_FORMAT",
+    "dump_storage",
 ]
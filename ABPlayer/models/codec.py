@@ -0,0 +1,209 @@
+"""
+
+Decoding of the book data.
+
+Values are converted from JSON types to the types of the fields
+by decoders created once per field (`make_value_decoder`).
+They are shared by the database row decoder (`database.field_types`)
+and the `.abp` decoder (`StorageDecoder`).
+
+`StorageDecoder` validates the `.abp` data in one pass over the schema
+of `Book` built once: each value is checked to have the JSON type
+of its field and is converted.
+
+"""
+
+from __future__ import annotations
+
+import dataclasses
+import typing as ty
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from enum import Enum
+from inspect import isclass
+from pathlib import Path
+
+import orjson
+from loguru import logger
+
+from .book import Book
+
+# Fields that can be missing in `.abp` of the old versions
+# {<field>: <default value>}
+OPTIONAL_STORAGE_FIELDS = {"multi_readers": False}
+
+
+def make_value_decoder(
+    python_type: ty.Any,
+) -> ty.Callable[[ty.Any], ty.Any]:
+    """
+    Creates a function converting the JSON value to the type.
+    :returns: Decoder of the value.
+    """
+    if python_type is datetime:
+        return decode_datetime
+    elif dataclasses.is_dataclass(python_type):
+        return lambda obj: python_type(**obj)
+    elif python_type in {dict, list}:
+        return _identity
+    elif hasattr(python_type, "from_dump"):
+        return python_type.from_dump
+    return python_type
+
+
+def json_type(python_type: ty.Any) -> type | None:
+    """
+    :returns: JSON type of the values of the type.
+        None - checked by the decoder.
+    """
+    if python_type is datetime:
+        return str
+    elif dataclasses.is_dataclass(python_type):
+        return dict
+    elif isclass(python_type) and not issubclass(python_type, Enum):
+        for json_type_ in (bool, str, int, float, list, dict):
+            if issubclass(python_type, json_type_):
+                return json_type_
+        if hasattr(python_type, "from_dump"):
+            return list
+    return None
+
+
+def decode_datetime(obj: bytes | str) -> datetime:
+    if isinstance(obj, bytes):
+        obj = obj.decode("utf-8")
+    return datetime.fromisoformat(obj)
+
+
+def _identity(obj: ty.Any) -> ty.Any:
+    return obj
+
+
+class StorageDecoder:
+    """
+    Creates books from the `.abp` files.
+    """
+
+    def __init__(self):
+        signature = ty.get_type_hints(Book)
+        del signature["id"]
+        # ((<field>, <JSON type>, <decoder>), ...)
+        self._fields = tuple(
+            (field_name, json_type(field_type), make_value_decoder(field_type))
+            for field_name, field_type in signature.items()
+        )
+
+    def decode(self, data: ty.Any) -> Book:
+        """
+        :returns: Book created from the data of the `.abp` file.
+        :raises ValueError: Incorrect data.
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"expected object, got `{type(data).__name__}`")
+        fields = {}
+        found = 0
+        for field_name, field_json_type, decoder in self._fields:
+            if (value := data.get(field_name)) is None:
+                if field_name not in OPTIONAL_STORAGE_FIELDS:
+                    raise ValueError(f"field `{field_name}` not found")
+                fields[field_name] = OPTIONAL_STORAGE_FIELDS[field_name]
+                continue
+            found += 1
+            if field_json_type is not None and not isinstance(
+                value, field_json_type
+            ):
+                raise ValueError(
+                    f"field value of `{field_name}` has "
+                    f"`{type(value).__name__}` type, "
+                    f"but expected `{field_json_type.__name__}`"
+                )
+            try:
+                fields[field_name] = decoder(value)
+            except (ValueError, TypeError) as err:
+                raise ValueError(
+                    f"field value of `{field_name}` is incorrect. "
+                    f"{type(err).__name__}: {err}"
+                )
+        if found != len(data):
+            raise ValueError("wrong fields count")
+        return Book(**fields)
+
+    def from_data(self, data: ty.Any, file_path: str) -> Book | None:
+        """
+        Creates a book from the data of the `.abp` file.
+        :param file_path: Path to the `.abp` file.
+        :returns: Book instance or None.
+        """
+        try:
+            book = self.decode(data)
+        except ValueError as err:
+            logger.opt(colors=True).debug(
+                f"incorrect data in <r>.abp</r> <y>{file_path}</y>: {err}"
+            )
+            return
+        if not str(Path(file_path).parent).endswith(
+            book_path := book.book_path[2:]
+        ):
+            logger.opt(colors=True).debug(
+                f"incorrect <r>.abp</r> file path <y>{file_path}</y> "
+                f"it's not ends on <y>{book_path}</y>"
+            )
+            return
+        return book
+
+    def loads(self, content: bytes, file_path: str) -> Book | None:
+        """
+        Creates a book from the content of the `.abp` file.
+        :returns: Book instance or None.
+        """
+        try:
+            data = orjson.loads(content)
+        except orjson.JSONDecodeError as err:
+            logger.opt(colors=True).debug(
+                f"error while loading book from <r>.abp</r> <y>{file_path}</y> : "
+                f"<lr>{type(err).__name__}: {err}</lr>"
+            )
+            return
+        return self.from_data(data, file_path)
+
+    def load(self, file_path: str) -> Book | None:
+        """
+        Creates a book from the `.abp` file.
+        :returns: Book instance or None.
+        """
+        logger.opt(colors=True).trace(
+            f"loading data from <r>.abp</r> <y>{file_path}</y>"
+        )
+        with open(file_path, "rb") as file:
+            return self.loads(file.read(), file_path)
+
+    def load_many(
+        self, file_paths: ty.Iterable[str], max_workers: int | None = None
+    ) -> ty.Generator[tuple[str, Book | None], ty.Any, None]:
+        """
+        Creates books from the `.abp` files.
+        Files are read concurrently, decoded in the calling thread.
+        Files that can't be read are skipped.
+        :returns: Generator of (<file path>, <book instance or None>).
+        """
+        file_paths = list(file_paths)
+        with ThreadPoolExecutor(max_workers) as executor:
+            for file_path, content in zip(
+                file_paths, executor.map(_read_file, file_paths)
+            ):
+                if content is not None:
+                    yield file_path, self.loads(content, file_path)
+
+
+def _read_file(file_path: str) -> bytes | None:
+    try:
+        with open(file_path, "rb") as file:
+            return file.read()
+    except IOError as err:
+        logger.opt(colors=True).error(
+            f"failed to read <r>.abp</r> <y>{file_path}</y>: "
+            f"<lr>{type(err).__name__}: {err}</lr>"
+        )
+
+
+storage_decoder = StorageDecoder()
@@ -1,18 +1,28 @@
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
+from itertools import batched
 
 import config
 import locales
 import webview
-from database import Database
-from drivers import Driver
-from drivers.base import LicensedDriver
+from database import (
+    IMPORT_BATCH_SIZE,
+    Database,
+    library_manifest,
+    library_model,
+    load_books,
+)
+from drivers import DRIVERS
 from loguru import logger
-from models.book import Book
+from startup_profiler import profiler
 from tools import pretty_view
 from web.app import app
 
+# Minimum time (in seconds) the starting window is shown
+MIN_STARTING_TIME = float(os.environ.get("MIN_STARTING_TIME", 2))
+
 
 def create_starting_window() -> webview.Window:
     """
@@ -53,6 +63,7 @@ def start_app(window: webview.Window) -> None:
     Analyzes the library.
     """
     logger.debug("starting app...")
+    profiler.start_profiling()
     start_time = time.time()
 
     updater_path = os.path.join(
@@ -63,26 +74,33 @@ def start_app(window: webview.Window) -> None:
     if os.path.isfile(updater_path):
         os.remove(updater_path)
 
-    config.init()
-    locales.set_language(os.environ["language"])
-    Database.init()
+    with profiler.phase("config"):
+        config.init()
+        locales.set_language(os.environ["language"])
+    with profiler.phase("database"):
+        Database.init()
     init_library(window)
 
     window.evaluate_js("setStatus('запуск...')")
 
-    success = 0
-    for driver in Driver.drivers:
-        if not issubclass(driver, LicensedDriver):
-            continue
-        if driver.auth_from_storage():
-            success += 1
+    with profiler.phase("drivers_auth"):
+        success = 0
+        for driver_info in DRIVERS:
+            if not driver_info.licensed:
+                continue
+            if driver_info.driver.auth_from_storage():
+                success += 1
     logger.opt(colors=True).debug(
         f"<y>{success}</y> drivers successfully authed"
     )
 
-    if (sub := time.time() - start_time) < 2:
-        logger.trace(f"sleeping {round(2 - sub, 2)}s （*＾-＾*）")
-        time.sleep(2 - sub)
+    profiler.finish()
+
+    if (sub := time.time() - start_time) < MIN_STARTING_TIME:
+        logger.trace(
+            f"sleeping {round(MIN_STARTING_TIME - sub, 2)}s （*＾-＾*）"
+        )
+        time.sleep(MIN_STARTING_TIME - sub)
 
     import main_window as main
 
@@ -100,26 +118,55 @@ def init_library(window: webview.Window) -> None:
     window.evaluate_js("setStatus('загрузка библиотеки...')")
 
     updates = False
-    correct_books_urls: list[str] = []
+    correct_books_urls: set[str] = set()
     incorrect_books_ids: list[int] = []
+    books_folder = os.environ["books_folder"]
     with Database() as db:
+        # Loading books from the manifest or scanning storage
+        logger.trace("loading books folder")
+        with profiler.phase("library_scanning"):
+            storage_books, from_manifest = library_manifest.load_library(
+                books_folder
+            )
+        # `.abp` files of the books from the manifest
+        # are checked by the verification of the manifest
+        known_abp_files = (
+            {book.abp_file_path for book in storage_books}
+            if from_manifest
+            else set()
+        )
+
         # Checking existing books in the database
         logger.trace("validating exists books")
-        offset = 0
-        books = db.get_libray(20, offset)
-        while books:
-            for book in books:
-                if book.files:
-                    if not os.path.exists(book.abp_file_path):
-                        incorrect_books_ids.append(book.id)
-                    else:
-                        correct_books_urls.append(book.url)
-                    if not book.url:
-                        book.url = f"file://{book.abp_file_path}"
-                        db.save(book)
-                        updates = True
-            offset += 20
-            books = db.get_libray(20, offset)
+        with profiler.phase("library_validation"):
+            downloaded_books = [
+                book
+                for book, has_files in db.get_books_storage_data()
+                if has_files
+            ]
+            with ThreadPoolExecutor() as executor:
+                abp_files_exists = list(
+                    executor.map(
+                        lambda file_path: (
+                            file_path in known_abp_files
+                            or os.path.exists(file_path)
+                        ),
+                        (book.abp_file_path for book in downloaded_books),
+                    )
+                )
+        for book, abp_file_exists in zip(downloaded_books, abp_files_exists):
+            if not abp_file_exists:
+                incorrect_books_ids.append(book.id)
+                continue
+            correct_books_urls.add(book.url)
+            if not book.url:
+                book = db.get_book_by_bid(book.id)
+                book.url = f"file://{book.abp_file_path}"
+                db.save(book)
+                updates = True
+        logger.opt(colors=True).debug(
+            f"<y>{len(downloaded_books)}</y> downloaded books validated"
+        )
 
         if incorrect_books_ids:
             logger.opt(lazy=True).debug(
@@ -129,22 +176,39 @@ def init_library(window: webview.Window) -> None:
             db.clear_files(*incorrect_books_ids)
             updates = True
 
-        # Scanning storage
-        logger.trace("scanning books folder")
-        for book in Book.scan_dir(os.environ["books_folder"]):
-            if book.url in correct_books_urls:
-                continue
-            if db_book := db.get_book_by_url(book.url):
-                if not db_book.files:
+        # Adding books from storage
+        with profiler.phase("library_import"):
+            added_books = 0
+            for books in batched(
+                load_books(
+                    book
+                    for book in storage_books
+                    if book.url not in correct_books_urls
+                ),
+                IMPORT_BATCH_SIZE,
+            ):
+                books_by_url = {book.url: book for book in books}
+                # Files of the book were deleted, but `.abp` was left
+                for url in db.check_is_books_exists(
+                    list(books_by_url), downloaded=False
+                ):
                     try:
-                        os.remove(book.abp_file_path)
+                        os.remove(books_by_url[url].abp_file_path)
                     except IOError:
                         pass
-                continue
-            db.add_book(book)
-            logger.opt(colors=True).debug(f"{book:styled} added to library")
-            updates = True
+                added_books += db.import_books(books)
+            if added_books:
+                logger.opt(colors=True).debug(
+                    f"<y>{added_books}</y> books added to library"
+                )
+                updates = True
 
         if updates:
             logger.trace("saving library")
             db.commit()
+
+        with profiler.phase("library_model"):
+            library_model.sync(db)
+
+    if from_manifest:
+        library_manifest.verify_in_background(books_folder)
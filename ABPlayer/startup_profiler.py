@@ -0,0 +1,206 @@
+"""
+
+Startup instrumentation.
+
+Measures wall and CPU time of the startup phases
+and import time of the heavy modules imported during the startup.
+The report is saved as JSON next to `debug.log` (`startup.json`).
+The last report of each version is kept,
+so regressions can be compared between versions.
+
+If the `PROFILE_STARTUP` environment variable is set,
+the heavy modules are imported eagerly to measure each of them,
+startup is also profiled with cProfile
+and the stats are dumped next to `debug.log` (`startup.prof`).
+
+"""
+
+from __future__ import annotations
+
+import cProfile
+import importlib
+import importlib.abc
+import os
+import sys
+import time
+import typing as ty
+from contextlib import contextmanager
+from datetime import datetime
+
+import orjson
+from loguru import logger
+
+# Modules whose import noticeably slows down the startup
+HEAVY_MODULES = (
+    "webview",
+    "bs4",
+    "eyed3",
+    "Crypto",
+    "m3u8",
+    "aiohttp",
+    "pygments.lexers",
+    "pygments.formatters",
+)
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.start_wall_time = time.perf_counter()
+        self.start_cpu_time = time.process_time()
+        self.phases: dict[str, dict[str, float]] = {}
+        self.imports: dict[str, float | None] = {}
+        # {<module name>: <import time> or None if it was already imported}
+        self._profile: cProfile.Profile | None = None
+
+    def record_imports(self, *modules: str) -> None:
+        """
+        Saves import time of the modules when they are imported.
+        Modules aren't imported by the profiler.
+        """
+        for module in modules:
+            if module in sys.modules:
+                self.imports.setdefault(module, None)
+        sys.meta_path.insert(0, _ImportRecorder(self, modules))
+
+    def measure_imports(self, *modules: str) -> None:
+        """
+        Imports modules and saves import time of each of them.
+        """
+        for module in modules:
+            if module in sys.modules:
+                self.imports.setdefault(module, None)
+                continue
+            start_time = time.perf_counter()
+            try:
+                importlib.import_module(module)
+            except ImportError as err:
+                logger.debug(f"failed to import {module}: {err}")
+                continue
+            self.imports[module] = round(time.perf_counter() - start_time, 4)
+
+    def start_profiling(self) -> None:
+        """
+        Enables cProfile in the current thread
+        if `PROFILE_STARTUP` environment variable is set.
+        """
+        if os.environ.get("PROFILE_STARTUP") and self._profile is None:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @contextmanager
+    def phase(self, name: str) -> ty.Generator[None, ty.Any, None]:
+        """
+        Measures wall and CPU time of the code block.
+        """
+        start_wall_time = time.perf_counter()
+        start_cpu_time = time.process_time()
+        try:
+            yield
+        finally:
+            self.phases[name] = dict(
+                wall=round(time.perf_counter() - start_wall_time, 4),
+                cpu=round(time.process_time() - start_cpu_time, 4),
+            )
+            logger.opt(colors=True).trace(
+                f"startup phase <y>{name}</y>: "
+                f"wall=<y>{self.phases[name]['wall']}</y>s "
+                f"cpu=<y>{self.phases[name]['cpu']}</y>s"
+            )
+
+    @property
+    def elapsed(self) -> float:
+        """
+        Wall time since the application started.
+        """
+        return time.perf_counter() - self.start_wall_time
+
+    def finish(self) -> None:
+        """
+        Stops profiling and saves the report.
+        """
+        sys.meta_path[:] = [
+            finder
+            for finder in sys.meta_path
+            if not isinstance(finder, _ImportRecorder)
+        ]
+        report = dict(
+            date=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            total=dict(
+                wall=round(self.elapsed, 4),
+                cpu=round(time.process_time() - self.start_cpu_time, 4),
+            ),
+            phases=self.phases,
+            imports=self.imports,
+        )
+        logger.opt(colors=True).debug(
+            f"startup finished in <y>{report['total']['wall']}</y>s"
+        )
+
+        if not (debug_path := os.environ.get("DEBUG_PATH")):
+            return
+        reports_dir = os.path.dirname(debug_path)
+
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(os.path.join(reports_dir, "startup.prof"))
+            self._profile = None
+
+        report_path = os.path.join(reports_dir, "startup.json")
+        reports = {}
+        try:
+            with open(report_path, "rb") as file:
+                reports = orjson.loads(file.read())
+        except (IOError, orjson.JSONDecodeError):
+            pass
+        reports[os.environ.get("VERSION", "0")] = report
+        try:
+            with open(report_path, "wb") as file:
+                file.write(orjson.dumps(reports, option=orjson.OPT_INDENT_2))
+        except IOError as err:
+            logger.error(
+                f"failed to save startup report. {type(err).__name__}: {err}"
+            )
+
+
+class _ImportRecorder(importlib.abc.MetaPathFinder):
+    """
+    Measures execution of the modules found by the other finders.
+    """
+
+    def __init__(self, profiler: StartupProfiler, modules: ty.Iterable[str]):
+        self.profiler = profiler
+        self.modules = set(modules)
+
+    def find_spec(self, name, path=None, target=None):
+        if name not in self.modules or name in self.profiler.imports:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            if (spec := finder.find_spec(name, path, target)) is not None:
+                break
+        else:
+            return None
+        if (
+            spec.loader is None
+            or isinstance(spec.loader, type)  # Shared by builtin modules
+            or not hasattr(spec.loader, "exec_module")
+        ):
+            return spec
+        exec_module = spec.loader.exec_module
+
+        def _exec_module(module) -> None:
+            start_time = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                self.profiler.imports[name] = round(
+                    time.perf_counter() - start_time, 4
+                )
+
+        # Loaders are created for each module
+        spec.loader.exec_module = _exec_module
+        return spec
+
+
+profiler = StartupProfiler()
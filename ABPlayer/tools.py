@@ -5,6 +5,7 @@ import math
 import os
 import re
 import subprocess
+import tempfile
 import time
 import typing as ty
 from functools import lru_cache, wraps
@@ -18,6 +19,11 @@ if ty.TYPE_CHECKING:
 
     from models.book import Book
 
+# Suffix of the temporary files written by `open_temp_file`
+TEMP_FILE_SUFFIX = ".tmp"
+# Temporary files modified before the start are left by the previous runs
+START_TIME = time.time()
+
 
 class Version:
     revisions = [None, "rc", "betta", "alpha"]
@@ -120,6 +126,81 @@ def convert_from_bytes(bytes_value: int) -> str:
     return "%s %s" % (s, size_name[i])
 
 
+def open_temp_file(file_path: ty.Union[str, Path]) -> ty.IO[bytes]:
+    """
+    Creates a temporary file next to the file.
+    Names are unique, so concurrent writers of the file
+    (e.g. the downloader process) never write the same temporary file.
+    :param file_path: The Way to the File.
+    :returns: Temporary file opened for writing.
+    """
+    return tempfile.NamedTemporaryFile(
+        "wb",
+        dir=os.path.dirname(file_path),
+        prefix=f"{os.path.basename(file_path)}.",
+        suffix=TEMP_FILE_SUFFIX,
+        delete=False,
+    )
+
+
+def remove_temp_file(file: ty.IO[bytes]) -> None:
+    """
+    Closes and removes the temporary file of the failed write.
+    """
+    file.close()
+    try:
+        os.remove(file.name)
+    except OSError:
+        pass
+
+
+def remove_temp_files(
+    dir_path: str, file_names: ty.Iterable[str], file_name: str
+) -> None:
+    """
+    Removes the temporary files of the file left by the previous runs
+    (e.g. the application was killed while writing).
+    Files created after the start of the process are being written.
+    :param dir_path: Directory of the file.
+    :param file_names: Names of the files in the directory.
+    :param file_name: Name of the file.
+    """
+    for temp_name in file_names:
+        if not (
+            temp_name.startswith(f"{file_name}.")
+            and temp_name.endswith(TEMP_FILE_SUFFIX)
+        ):
+            continue
+        temp_path = os.path.join(dir_path, temp_name)
+        try:
+            if os.path.getmtime(temp_path) < START_TIME:
+                os.remove(temp_path)
+                logger.opt(colors=True).debug(
+                    f"temporary file <y>{temp_path}</y> removed"
+                )
+        except OSError:
+            pass
+
+
+def write_file_atomic(file_path: ty.Union[str, Path], data: bytes) -> None:
+    """
+    Writes the file through a temporary file which replaces it,
+    so the file is never left truncated.
+    :param file_path: The Way to the File.
+    :param data: New content of the file.
+    """
+    file = open_temp_file(file_path)
+    try:
+        with file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(file.name, file_path)
+    except BaseException:
+        remove_temp_file(file)
+        raise
+
+
 def get_file_hash(
     file_path: ty.Union[str, Path], hash_func=hashlib.sha256
 ) -> str:
@@ -156,6 +156,16 @@ document.addEventListener("DOMContentLoaded", (event) => {
     scale.oninput();
   }
   player.on("pause", (event) => {
+    // currentTime is 0 while the next book or chapter is being loaded
+    if (player.current_book && player.currentTime) {
+      pywebview.api.set_stop_flag(
+        player.current_book.bid,
+        player.current_item_index,
+        Math.floor(player.currentTime),
+        true,
+      );
+      last_stop_flag_time = player.currentTime;
+    }
     let smallPlaybackControl = smallPlayer.querySelector(
       ".small-playback-control",
     );
@@ -217,6 +227,7 @@ document.addEventListener("DOMContentLoaded", (event) => {
         player.current_book.bid,
         player.current_item_index,
         Math.floor(player.duration),
+        true,
       );
       player.current_book.status = "finished";
       initBookListeningProgress(player.current_book);
@@ -249,10 +260,7 @@ function initBook(book) {
     openBookPage(player.current_book.bid);
   };
   player.current_book = book;
-  let total_duration = 0;
-  for (let item of book.items)
-    total_duration += item.end_time - item.start_time;
-  player.total_duration = total_duration;
+  player.total_duration = book.offsets[book.offsets.length - 1];
   _selectItem(book.stop_flag.item);
   if (book.stop_flag.time) {
     player.play();
@@ -312,12 +320,7 @@ function selectItem(item_index) {
   _selectItem(item_index);
 }
 function _selectItem(item_index) {
-  let previous_items_duration = 0;
-  for (let i of Array(item_index).keys()) {
-    item = player.current_book.items[i];
-    previous_items_duration += item.end_time - item.start_time;
-  }
-  player.previous_items_duration = previous_items_duration;
+  player.previous_items_duration = player.current_book.offsets[item_index];
   let playing = player.playing;
   player.source = {
     type: "audio",
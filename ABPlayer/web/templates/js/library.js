@@ -82,43 +82,31 @@ async function searchBooksInLibrary() {
 is_authors_section_full = false;
 is_series_section_full = false;
 function fillFilterBySections() {
-  pywebview.api.get_all_authors().then((response) => {
-    filter_by_section = document.getElementById("authors-section");
-    filter_by_section_btn = document.getElementById("authors-section-btn");
-    if (!response.data.length) {
-      is_authors_section_full = false;
-      filter_by_section_btn.classList.add("disabled");
-      return;
-    }
-    filter_by_section_btn.classList.remove("disabled");
-    html = "";
-    for (obj of response.data) {
-      html =
-        html +
-        `<div class="filter-by-section-item" data-value="${obj}" onclick="filterByAuthor(this.dataset.value)">${obj}</div>`;
-    }
-    filter_by_section.innerHTML = html;
+  pywebview.api.get_library_facets().then((response) => {
+    fillFilterBySection("authors", response.data.authors, "filterByAuthor");
     if (urlParams.get("author")) selectFilterBy(urlParams.get("author"));
-  });
-  pywebview.api.get_all_series().then((response) => {
-    filter_by_section = document.getElementById("series-section");
-    filter_by_section_btn = document.getElementById("series-section-btn");
-    if (!response.data.length) {
-      is_series_section_full = false;
-      filter_by_section_btn.classList.add("disabled");
-      return;
-    }
-    filter_by_section_btn.classList.remove("disabled");
-    html = "";
-    for (obj of response.data) {
-      html =
-        html +
-        `<div class="filter-by-section-item" data-value="${obj}" onclick="filterBySeries(this.dataset.value)">${obj}</div>`;
-    }
-    filter_by_section.innerHTML = html;
+    fillFilterBySection("series", response.data.series, "filterBySeries");
     if (urlParams.get("series")) selectFilterBy(urlParams.get("series"));
   });
 }
+function fillFilterBySection(name, facets, onclick) {
+  filter_by_section = document.getElementById(`${name}-section`);
+  filter_by_section_btn = document.getElementById(`${name}-section-btn`);
+  if (!facets.length) {
+    if (name == "authors") is_authors_section_full = false;
+    else is_series_section_full = false;
+    filter_by_section_btn.classList.add("disabled");
+    return;
+  }
+  filter_by_section_btn.classList.remove("disabled");
+  html = "";
+  for (obj of facets) {
+    html =
+      html +
+      `<div class="filter-by-section-item" data-value="${obj.name}" title="${obj.books} (${obj.downloaded}) · ${obj.duration}" onclick="${onclick}(this.dataset.value)">${obj.name}</div>`;
+  }
+  filter_by_section.innerHTML = html;
+}
 
 class Section extends Page {
   constructor(el) {
@@ -136,6 +124,9 @@ class Section extends Page {
 }
 
 var books_in_sections = {};
+// Cursors of the next pages: {<section id>: [<after 1st page>, <current>]}
+var sections_cursors = {};
+var sections_totals = {};
 var sections = {};
 for (section_el of document.getElementsByClassName("books-section")) {
   section_ = new Section(section_el);
@@ -151,6 +142,8 @@ function section(el_id) {
 function clearLibrary() {
   for ([_, container] of Object.entries(sections)) container.el.innerHTML = "";
   books_in_sections = {};
+  sections_cursors = {};
+  sections_totals = {};
   fetching_books = false;
   can_get_next_books = true;
 }
@@ -190,9 +183,12 @@ function onHideSection(el) {
   document.getElementById("library-sections-container").scrollTop = 0;
   fetching_books = false;
   can_get_next_books = true;
-  if (books_in_section > 5) {
-    books_in_sections[el.id] = 5;
-    while (el.children.length > 5) el.removeChild(el.lastChild);
+  if (books_in_section > 10) {
+    // Keeping only the first page. Pages are fetched by 10 books
+    // and the keyset cursor is known only at the end of a page
+    books_in_sections[el.id] = 10;
+    sections_cursors[el.id][1] = sections_cursors[el.id][0];
+    while (el.children.length > 10) el.removeChild(el.lastChild);
   }
 }
 function addBooks(el) {
@@ -204,10 +200,17 @@ function addBooks(el) {
   } else if (el.id == "listened-books-section") {
     status = "finished";
   }
-  let books_in_section = books_in_sections[el.id];
   if (!books_in_sections.hasOwnProperty(el.id)) {
-    books_in_section = 0;
     books_in_sections[el.id] = 0;
+    sections_cursors[el.id] = [null, null];
+  } else if (
+    books_in_sections[el.id] >= sections_totals[el.id] ||
+    sections_cursors[el.id][1] === null
+  ) {
+    // All books of the section are shown
+    can_get_next_books = false;
+    fetching_books = false;
+    return;
   }
   el.classList.add("loading");
   let sort = urlParams.get("sort");
@@ -220,7 +223,7 @@ function addBooks(el) {
   pywebview.api
     .get_library(
       10,
-      books_in_section,
+      sections_cursors[el.id][1],
       sort,
       reverse,
       author,
@@ -262,7 +265,12 @@ function showBooks(response, status) {
   if (container.id != Section.current.el.id) return;
 
   html = "";
-  for (book of response.data) {
+  if (response.data.total !== null)
+    sections_totals[container.id] = response.data.total;
+  if (books_in_sections[container.id] == 0)
+    sections_cursors[container.id][0] = response.data.cursor;
+  sections_cursors[container.id][1] = response.data.cursor;
+  for (book of response.data.books) {
     html =
       html +
       `
@@ -297,9 +305,9 @@ function showBooks(response, status) {
   }
 
   fetching_books = false;
-  if (response.data.length < 10) can_get_next_books = false;
+  if (response.data.cursor === null) can_get_next_books = false;
   books_in_sections[container.id] =
-    books_in_sections[container.id] + response.data.length;
+    books_in_sections[container.id] + response.data.books.length;
   container.innerHTML = container.innerHTML + html;
   container.classList.remove("loading");
 }
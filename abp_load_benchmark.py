@@ -0,0 +1,77 @@
+"""
+
+Script for measuring loading of the `.abp` files.
+Writes a synthetic library to a temporary books folder and compares
+loading the books one by one (`Book.load_from_storage`)
+and by `Book.scan_dir` (files are read concurrently).
+
+Usage: python abp_load_benchmark.py [books] [chapters per book]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "ABPlayer"))
+
+from models.book import Book, BookItem, BookItems, dump_storage  # noqa
+
+BOOKS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+CHAPTERS = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+
+def make_library(books_folder: str) -> list[str]:
+    file_paths = []
+    for bid in range(BOOKS):
+        book = Book(
+            author=f"Автор {bid % 100}",
+            name=f"Книга {bid}",
+            series_name=f"Серия {bid % 10}",
+            number_in_series=str(bid % 10),
+            description="Описание " * 20,
+            reader=f"Чтец {bid % 50}",
+            duration="10:00:00",
+            url=f"https://example.com/books/{bid}",
+            preview=f"https://example.com/books/{bid}.jpg",
+            driver="Example",
+            items=BookItems(
+                BookItem(
+                    file_url=f"https://example.com/books/{bid}/{i}.mp3",
+                    file_index=i + 1,
+                    title=f"Глава {i + 1}",
+                    start_time=0,
+                    end_time=600,
+                )
+                for i in range(CHAPTERS)
+            ),
+        )
+        os.makedirs(book.dir_path, exist_ok=True)
+        with open(book.abp_file_path, "wb") as file:
+            file.write(dump_storage(book.to_dump()))
+        file_paths.append(book.abp_file_path)
+    return file_paths
+
+
+def measure(name: str, load) -> None:
+    start_time = time.perf_counter()
+    books = load()
+    total_time = time.perf_counter() - start_time
+    assert len(books) == BOOKS, len(books)
+    print(
+        f"{name:<20}{total_time:>10.2f} s"
+        f"{BOOKS / total_time:>12.0f} books/s"
+    )
+
+
+if __name__ == "__main__":
+    print(f"{BOOKS} books, {CHAPTERS} chapters per book")
+    with tempfile.TemporaryDirectory() as books_folder:
+        os.environ["books_folder"] = books_folder
+        file_paths = make_library(books_folder)
+        measure(
+            "one by one",
+            lambda: [Book.load_from_storage(path) for path in file_paths],
+        )
+        measure("scan_dir", lambda: list(Book.scan_dir(books_folder)))
@@ -0,0 +1,89 @@
+"""
+
+Script for measuring memory used by the items of the books.
+Builds a synthetic library and compares the items stored as
+dataclasses with `__dict__`, slotted `BookItem` and `ColumnarBookItems`.
+
+Usage: python book_memory_benchmark.py [books] [chapters per book]
+
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "ABPlayer"))
+
+from models.book import BookItem, BookItems, ColumnarBookItems  # noqa
+
+BOOKS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+CHAPTERS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+# Chapters of one file
+CHAPTERS_PER_FILE = 10
+
+
+@dataclass
+class DictBookItem:
+    """
+    `BookItem` without slots.
+    """
+
+    file_url: str
+    file_index: int
+    title: str
+    start_time: int | float
+    end_time: int | float
+
+
+def make_library(item_type: type, items_type: type) -> list:
+    library = []
+    for bid in range(BOOKS):
+        items = items_type()
+        file_url = ""
+        for i in range(CHAPTERS):
+            if i % CHAPTERS_PER_FILE == 0:
+                file_url = f"https://example.com/books/{bid}/{i}.mp3"
+            start_time = (i % CHAPTERS_PER_FILE) * 600.5
+            items.append(
+                item_type(
+                    file_url=file_url,
+                    file_index=i // CHAPTERS_PER_FILE,
+                    title=f"Глава {i + 1}",
+                    start_time=start_time,
+                    end_time=start_time + 600.5,
+                )
+            )
+        library.append(items)
+    return library
+
+
+def measure(name: str, item_type: type, items_type: type) -> None:
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    library = make_library(item_type, items_type)
+    build_time = time.perf_counter() - start_time
+    size, __ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start_time = time.perf_counter()
+    for items in library:
+        sum(item.end_time - item.start_time for item in items)
+    iter_time = time.perf_counter() - start_time
+
+    print(
+        f"{name:<20}{size / 2**20:>10.1f} MiB"
+        f"{size / (BOOKS * CHAPTERS):>10.1f} B/item"
+        f"{build_time:>10.2f} s build{iter_time:>10.2f} s iterate"
+    )
+    del library
+
+
+if __name__ == "__main__":
+    print(f"{BOOKS} books, {CHAPTERS} chapters per book")
+    measure("dict dataclass", DictBookItem, BookItems)
+    measure("slotted dataclass", BookItem, BookItems)
+    measure("columnar", BookItem, ColumnarBookItems)
@@ -46,6 +46,9 @@ args = parser.parse_args()
 DEV: bool = args.dev
 __version__ = Version.from_str(args.version)
 locales = ["en", "ru"]
+# drivers are imported on demand (see ABPlayer/drivers/registry.py),
+# so PyInstaller can't find them by itself
+drivers = ["akniga", "bookmate", "izibuk", "knigavuhe", "librivox", "yakniga"]
 arch = " x32" if platform.architecture()[0] == "32bit" else ""
 dev_path = os.path.join(os.path.dirname(__file__), "..", "ABPlayer")
 run_file_path = os.path.join(dev_path, "run.py")
@@ -111,6 +114,7 @@ PyInstaller.__main__.run(
         f"--add-data={os.path.join(dev_path, 'web', 'static')};static",
         f"--add-data={os.path.join(dev_path, 'web', 'templates')};templates",
         f"--add-data={os.path.join(dev_path, 'drivers', 'bin')};bin",
+        *(f"--hidden-import=drivers.{driver}" for driver in drivers),
         *(
             "--add-data="
             f"{os.path.join(dev_path, 'locales', lang, 'LC_MESSAGES', 'base.mo')};"
@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('E:\\projects\\worktrees\\AudioBookPlayer\\jade-thorn\\AudioBookPlayer\\build\\..\\ABPlayer\\web\\static', 'static'), ('E:\\projects\\worktrees\\AudioBookPlayer\\jade-thorn\\AudioBookPlayer\\build\\..\\ABPlayer\\web\\templates', 'templates'), ('E:\\projects\\worktrees\\AudioBookPlayer\\jade-thorn\\AudioBookPlayer\\build\\..\\ABPlayer\\drivers\\bin', 'bin'), ('E:\\projects\\worktrees\\AudioBookPlayer\\jade-thorn\\AudioBookPlayer\\build\\..\\ABPlayer\\locales\\en\\LC_MESSAGES\\base.mo', 'locales/en/LC_MESSAGES'), ('E:\\projects\\worktrees\\AudioBookPlayer\\jade-thorn\\AudioBookPlayer\\build\\..\\ABPlayer\\locales\\ru\\LC_MESSAGES\\base.mo', 'locales/ru/LC_MESSAGES')],
-    hiddenimports=[],
+    hiddenimports=['drivers.akniga', 'drivers.bookmate', 'drivers.izibuk', 'drivers.knigavuhe', 'drivers.librivox', 'drivers.yakniga'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,223 @@
+"""
+
+Script for checking the query plans of the library queries.
+Builds a synthetic library in a temporary database, runs the library
+queries, explains each executed statement (`Database.explain`)
+and checks that it uses the expected index.
+
+Usage: python query_plan_benchmark.py [books]
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "ABPlayer"))
+
+from database import Database  # noqa
+from models.book import Book, BookItem, BookItems, Status, StopFlag  # noqa
+
+BOOKS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+CHAPTERS = 10
+
+
+class RecordingDatabase(Database):
+    """
+    Database recording the executed queries.
+    """
+
+    queries: list[tuple[str, tuple]] = []
+
+    def _fetchone(self, query: str, *args) -> tuple | None:
+        self.queries.append((query, args))
+        return super()._fetchone(query, *args)
+
+    def _fetchall(self, query: str, *args) -> list[tuple]:
+        self.queries.append((query, args))
+        return super()._fetchall(query, *args)
+
+
+def book_url(bid: int) -> str:
+    return f"https://example.com/books/{bid}"
+
+
+def make_book(bid: int) -> Book:
+    statuses = list(Status)
+    return Book(
+        author=f"Автор {bid % 2000}",
+        name=f"Книга {bid}",
+        series_name=f"Серия {bid % 5000}" if bid % 3 else "",
+        number_in_series=str(bid % 10),
+        reader=f"Чтец {bid % 300}",
+        duration="10:00:00",
+        url=book_url(bid),
+        driver="Example",
+        items=BookItems(
+            BookItem(
+                file_url=f"https://example.com/books/{bid}/{i}.mp3",
+                file_index=i + 1,
+                title=f"Глава {i + 1}",
+                start_time=0,
+                end_time=600,
+            )
+            for i in range(CHAPTERS)
+        ),
+        status=statuses[bid % len(statuses)],
+        stop_flag=StopFlag(item=bid % CHAPTERS, time=bid % 600),
+        favorite=bid % 7 == 0,
+        adding_date=datetime(2020, 1, 1) + timedelta(minutes=bid),
+    )
+
+
+def make_library() -> None:
+    with Database() as db:
+        for bid in range(BOOKS):
+            db.add_book(make_book(bid))
+        db.commit()
+
+
+def query_page(
+    db: Database,
+    cursor=None,
+    sort: str = "adding_date",
+    reverse: bool = True,
+    **filters,
+):
+    """
+    Pages without the search are served by `library_model`.
+    Its SQL fallback is checked.
+    """
+    filters = {
+        filter_name: filters.get(filter_name)
+        for filter_name in (
+            "author",
+            "series",
+            "favorite",
+            "status",
+            "bids",
+            "search_query",
+            "progress",
+        )
+    }
+    return db._query_library_page(30, cursor, sort, reverse, **filters)
+
+
+# (<name>, <call>, <indexes any of which must be used>)
+CHECKS = [
+    (
+        "book by url",
+        lambda db: db.get_book_by_url(book_url(123)),
+        {"books_url_idx"},
+    ),
+    (
+        "books exist by urls",
+        lambda db: db.check_is_books_exists(
+            [book_url(bid) for bid in range(0, 5000, 50)]
+        ),
+        {"books_url_idx"},
+    ),
+    (
+        "multi readers",
+        lambda db: db.mark_multi_readers(
+            Book(author="Автор 1", name="Книга 1")
+        ),
+        {"books_author_name_idx"},
+    ),
+    (
+        "default page",
+        lambda db: query_page(db),
+        {"books_adding_date_idx"},
+    ),
+    (
+        "next default page",
+        lambda db: query_page(db, query_page(db)[1]),
+        {"books_adding_date_idx"},
+    ),
+    (
+        "page by status",
+        lambda db: query_page(db, status="started"),
+        {"books_status_adding_date_idx"},
+    ),
+    (
+        "page of favorites",
+        lambda db: query_page(db, favorite=True),
+        {"books_favorite_idx"},
+    ),
+    (
+        "page by duration",
+        lambda db: query_page(db, sort="duration_sec", reverse=False),
+        {"books_duration_idx"},
+    ),
+    (
+        "page of author",
+        lambda db: query_page(db, author="Автор 7"),
+        {"books_author_facet_idx"},
+    ),
+    (
+        "page of series",
+        lambda db: query_page(db, series="Серия 7"),
+        {"books_series_facet_idx"},
+    ),
+    (
+        "search page",
+        lambda db: db.get_library_page(30, search_query="книга 7"),
+        {"books_fts"},
+    ),
+    (
+        "search count",
+        lambda db: db.count_library(search_query="книга 7"),
+        {"books_fts"},
+    ),
+    (
+        "authors facet",
+        lambda db: db.get_facets("authors"),
+        {"books_author_facet_idx"},
+    ),
+    (
+        "series facet",
+        lambda db: db.get_facets("series"),
+        {"books_series_facet_idx"},
+    ),
+]
+
+
+def check(name, call, indexes: set[str]) -> bool:
+    RecordingDatabase.queries.clear()
+    with RecordingDatabase() as db:
+        start_time = time.perf_counter()
+        call(db)
+        total_time = (time.perf_counter() - start_time) * 1000
+        plans = [
+            db.explain(query, *args)
+            for query, args in RecordingDatabase.queries
+            if query.lstrip().upper().startswith("SELECT")
+        ]
+    ok = bool(plans) and all(
+        # Books found by the query are fetched by id
+        any(index in plan for index in indexes | {"INTEGER PRIMARY KEY"})
+        # Full scans of the books table are not allowed
+        and "SCAN books\n" not in f"{plan}\n"
+        for plan in plans
+    )
+    print(f"{'ok' if ok else 'FAIL':<6}{name:<24}{total_time:>10.2f} ms")
+    if not ok:
+        print("\n\n".join(plans))
+    return ok
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ["books_folder"] = temp_dir
+        Database.database_path = os.path.join(temp_dir, "library.sqlite")
+        Database.init()
+        start_time = time.perf_counter()
+        make_library()
+        total_time = time.perf_counter() - start_time
+        print(f"{BOOKS} books added in {total_time:.2f} s")
+        results = [check(*args) for args in CHECKS]
+        Database.close()
+    if not all(results):
+        sys.exit(1)